@@ -4,14 +4,13 @@ from pathlib import Path
 from typing import Dict, List
 from urllib.parse import urlencode
 
-import httpx
+from .libraries.http_client import WAHLAP, http
 from .libraries.path_config import STATIC
 
 async def update_pl():
-    async with httpx.AsyncClient() as client:
-        urls = "http://wc.wahlap.net/maidx/rest/location"
-        response = await client.get(urls)
-        result = response.json()
+    urls = f"{WAHLAP}/maidx/rest/location"
+    response = await http.get(urls, endpoint="location")
+    result = response.json()
     if result:
         with (
             Path(STATIC)
@@ -0,0 +1,37 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from .cache import AsyncTTLCache
+from .image_cache import fingerprint
+
+# AI锐评结果缓存，成绩、人设和prompt都相同时直接复用
+comment_cache = AsyncTTLCache(3600, 256)
+
+
+def comment_key(prompt: str, context: List[Dict[str, Any]], system_prompt: str) -> str:
+    """prompt 中已包含成绩文本，context 和 system_prompt 决定人设"""
+    return fingerprint("comment", prompt, context, system_prompt)
+
+
+class ProviderLimiter(object):
+    """按模型提供商限制同时进行的锐评请求数"""
+
+    def __init__(self, limit: int = 2):
+        self.limit = limit
+        self._semaphores: Dict[int, asyncio.Semaphore] = {}
+
+    def configure(self, limit: Optional[int] = None):
+        if limit is not None:
+            self.limit = max(1, limit)
+            self._semaphores = {}
+
+    def __call__(self, provider: Any) -> asyncio.Semaphore:
+        key = id(provider)
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limit)
+            self._semaphores[key] = semaphore
+        return semaphore
+
+
+provider_limiter = ProviderLimiter()
@@ -0,0 +1,96 @@
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from PIL import Image, ImageFont
+
+from .path_config import STATIC
+
+
+class AssetManager(object):
+    """
+    进程级的UI素材与字体缓存。
+
+    每张素材按 (文件名, 缩放比例, 目标尺寸) 只读取、转换和缩放一次，
+    每个 (字体, 字号) 只加载一次。sprite() 返回的是共享对象，只能作为
+    paste 的来源；需要在上面绘制时请使用 sprite_copy()。
+    """
+
+    def __init__(self, pic_dir: Path, font_dir: Path):
+        self.pic_dir = pic_dir
+        self.font_dir = font_dir
+        self._sprites: Dict[Tuple[str, float, Optional[Tuple[int, int]]], Image.Image] = {}
+        self._fonts: Dict[Tuple[str, int, str], ImageFont.FreeTypeFont] = {}
+        self._composites: Dict[Hashable, Any] = {}
+        self._lock = threading.Lock()
+
+    def sprite(self, name: str, scale: float = 1.0, size: Optional[Tuple[int, int]] = None) -> Image.Image:
+        key = (name, scale, size)
+        img = self._sprites.get(key)
+        if img is not None:
+            return img
+        with self._lock:
+            img = self._sprites.get(key)
+            if img is None:
+                with Image.open(self.pic_dir / name) as raw:
+                    img = raw.convert("RGBA")
+                if size is not None:
+                    img = img.resize(size)
+                elif scale != 1.0:
+                    img = img.resize((int(img.size[0] * scale), int(img.size[1] * scale)))
+                self._sprites[key] = img
+        return img
+
+    def sprite_copy(self, name: str, scale: float = 1.0, size: Optional[Tuple[int, int]] = None) -> Image.Image:
+        return self.sprite(name, scale, size).copy()
+
+    def font(self, name: str, size: int, encoding: str = "utf-8") -> ImageFont.FreeTypeFont:
+        key = (name, size, encoding)
+        font = self._fonts.get(key)
+        if font is not None:
+            return font
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is None:
+                font = ImageFont.truetype(str(self.font_dir / name), size, encoding=encoding)
+                self._fonts[key] = font
+        return font
+
+    def composite(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """由素材合成的结果（如模板底图），每个 key 只构建一次，随 reload() 一起失效"""
+        value = self._composites.get(key)
+        if value is None:
+            value = build()
+            with self._lock:
+                value = self._composites.setdefault(key, value)
+        return value
+
+    def reload(self):
+        """
+        清空缓存，下次使用时重新从磁盘读取，用于资源更新后。
+        其他线程可能仍在使用旧的素材绘制，只替换缓存，旧对象不再被引用后由垃圾回收释放
+        """
+        with self._lock:
+            self._sprites = {}
+            self._fonts = {}
+            self._composites = {}
+
+    def memory_footprint(self) -> Dict[str, int]:
+        """估算缓存占用的内存"""
+        sprite_bytes = sum(img.width * img.height * len(img.getbands()) for img in self._sprites.values())
+        font_files = {font.path for font in self._fonts.values() if isinstance(getattr(font, "path", None), str)}
+        font_bytes = 0
+        for path in font_files:
+            try:
+                font_bytes += Path(path).stat().st_size
+            except OSError:
+                pass
+        return {
+            "sprites": len(self._sprites),
+            "sprite_bytes": sprite_bytes,
+            "fonts": len(self._fonts),
+            "font_file_bytes": font_bytes,
+        }
+
+
+assets = AssetManager(STATIC / "mai" / "pic", STATIC)
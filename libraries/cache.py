@@ -0,0 +1,91 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class AsyncTTLCache(object):
+    """
+    带过期时间和容量上限的异步缓存。
+
+    get_or_fetch() 对同一个 key 的并发请求只会调用一次 fetch，其余请求等待同一个结果；
+    force=True 时跳过缓存重新获取。cacheable 用于决定结果是否写入缓存，例如只缓存成功的响应。
+    """
+
+    def __init__(self, ttl: float = 60, maxsize: int = 256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, ttl: Optional[float] = None, maxsize: Optional[int] = None):
+        if ttl is not None:
+            self.ttl = max(0, ttl)
+        if maxsize is not None:
+            self.maxsize = max(0, maxsize)
+        self._evict()
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        self._evict()
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    async def get_or_fetch(
+        self,
+        key: Hashable,
+        fetch: Callable[[], Awaitable[T]],
+        force: bool = False,
+        cacheable: Callable[[T], bool] = lambda value: True,
+    ) -> T:
+        if not force:
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            # fetch 在独立任务中执行，单个调用方被取消不会影响其他等待者
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_fetched(key, t, cacheable))
+        return await asyncio.shield(task)
+
+    def _on_fetched(self, key: Hashable, task: "asyncio.Task", cacheable: Callable[[Any], bool]):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        value = task.result()
+        if cacheable(value):
+            self.set(key, value)
@@ -0,0 +1,145 @@
+import random
+from typing import Any, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+class ChartRow(object):
+    """目录中的一行：某首曲目的某个难度"""
+
+    __slots__ = ("music", "level_index", "ds", "level")
+
+    def __init__(self, music: Any, level_index: int, ds: float, level: str):
+        self.music = music
+        self.level_index = level_index
+        self.ds = ds
+        self.level = level
+
+    def __repr__(self):
+        return f"ChartRow({self.music.id}, {self.music.title!r}, {self.level_index}, {self.ds})"
+
+
+class ChartView(object):
+    """
+    查询结果，只保存命中行的下标，不复制曲目数据
+    """
+
+    def __init__(self, catalogue: "ChartCatalogue", rows: np.ndarray):
+        self.catalogue = catalogue
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[ChartRow]:
+        for row in self.rows.tolist():
+            yield self.catalogue.row(row)
+
+    def __getitem__(self, index: int) -> ChartRow:
+        return self.catalogue.row(int(self.rows[index]))
+
+    def random(self) -> Optional[ChartRow]:
+        if not len(self.rows):
+            return None
+        return self.catalogue.row(int(self.rows[random.randrange(len(self.rows))]))
+
+    def musics(self) -> List[Tuple[Any, List[int]]]:
+        """按曲目分组，返回 [(曲目, 命中的难度下标列表), ...]，顺序与曲目列表一致"""
+        if not len(self.rows):
+            return []
+        song_idx = self.catalogue.song_idx[self.rows]
+        level_index = self.catalogue.level_index[self.rows]
+        order = np.lexsort((level_index, song_idx))
+        result: List[Tuple[Any, List[int]]] = []
+        last = -1
+        for song, diff in zip(song_idx[order].tolist(), level_index[order].tolist()):
+            if song != last:
+                result.append((self.catalogue.musics[song], []))
+                last = song
+            result[-1][1].append(diff)
+        return result
+
+
+Condition = Union[Any, Sequence[Any], Tuple[Any, Any]]
+
+
+def _match(column: np.ndarray, elem: Condition) -> Optional[np.ndarray]:
+    """与 in_or_equal 相同的语义：列表表示包含，元组表示闭区间，其他表示相等"""
+    if elem is Ellipsis or elem is None:
+        return None
+    if isinstance(elem, tuple):
+        return (column >= elem[0]) & (column <= elem[1])
+    if isinstance(elem, list):
+        return np.isin(column, elem)
+    return column == elem
+
+
+class ChartCatalogue(object):
+    """
+    谱面级的列式目录，每个 (曲目, 难度) 占一行。
+
+    数值列使用 NumPy 数组，query() 对各列做向量化筛选，返回只含行下标的 ChartView。
+    """
+
+    def __init__(self, musics: List[Any]):
+        self.musics = musics
+        song_idx, level_index, ds, level = [], [], [], []
+        for i, music in enumerate(musics):
+            if not music.ds or not music.level:
+                continue
+            for j, (d, lv) in enumerate(zip(music.ds, music.level)):
+                song_idx.append(i)
+                level_index.append(j)
+                ds.append(d)
+                level.append(lv)
+        self.song_idx = np.array(song_idx, dtype=np.int32)
+        self.level_index = np.array(level_index, dtype=np.int8)
+        self.ds = np.array(ds, dtype=np.float64)
+        self.level = np.array(level, dtype=str)
+        self.type = np.array([m.type or "" for m in musics], dtype=str)[self.song_idx]
+        self.bpm = np.array([m.bpm or 0 for m in musics], dtype=np.float64)[self.song_idx]
+        self.version = np.array([m.version or "" for m in musics], dtype=str)[self.song_idx]
+        self.genre = np.array([m.genre or "" for m in musics], dtype=str)[self.song_idx]
+        self.title = np.array([m.title or "" for m in musics], dtype=str)[self.song_idx]
+        self._title_lower = np.char.lower(self.title)
+
+    def __len__(self):
+        return len(self.song_idx)
+
+    def row(self, row: int) -> ChartRow:
+        return ChartRow(
+            self.musics[self.song_idx[row]],
+            int(self.level_index[row]),
+            float(self.ds[row]),
+            str(self.level[row]),
+        )
+
+    def query(
+        self,
+        *,
+        level: Condition = ...,
+        ds: Condition = ...,
+        title_search: Optional[str] = ...,
+        genre: Condition = ...,
+        bpm: Condition = ...,
+        type_: Condition = ...,
+        version: Condition = ...,
+        diff: Optional[List[int]] = ...,
+    ) -> ChartView:
+        mask = np.ones(len(self), dtype=bool)
+        for column, elem in (
+            (self.level, level),
+            (self.ds, ds),
+            (self.genre, genre),
+            (self.bpm, bpm),
+            (self.type, type_),
+            (self.version, version),
+        ):
+            matched = _match(column, elem)
+            if matched is not None:
+                mask &= matched
+        if diff is not Ellipsis and diff is not None:
+            mask &= np.isin(self.level_index, diff)
+        if title_search is not Ellipsis and title_search:
+            mask &= np.char.find(self._title_lower, title_search.lower()) >= 0
+        return ChartView(self, np.flatnonzero(mask))
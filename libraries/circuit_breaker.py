@@ -0,0 +1,61 @@
+import time
+from typing import Optional
+
+from astrbot.api import logger
+
+
+class CircuitBreaker(object):
+    """
+    熔断器。
+
+    连续失败 failure_threshold 次后断开，cooldown 秒内 allow() 返回 False；
+    冷却结束后放行一次试探请求，成功则恢复，失败则重新断开。
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, cooldown: float = 120):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    def configure(self, failure_threshold: Optional[int] = None, cooldown: Optional[float] = None):
+        if failure_threshold is not None:
+            self.failure_threshold = max(1, failure_threshold)
+        if cooldown is not None:
+            self.cooldown = max(0, cooldown)
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self._probing or time.monotonic() - self._opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        if self._probing or time.monotonic() - self._opened_at < self.cooldown:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self):
+        if self._opened_at is not None:
+            logger.info(f"{self.name} 已恢复")
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or (self._opened_at is None and self.failures >= self.failure_threshold):
+            logger.warning(f"{self.name} 连续失败 {self.failures} 次，{self.cooldown:.0f}秒内不再请求")
+            self._opened_at = time.monotonic()
+        self._probing = False
+
+    def release(self):
+        """试探请求被取消、没有结果时调用，允许下一次重新试探"""
+        self._probing = False
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import aiofiles
+import httpx
+from astrbot.api import logger
+from bs4 import BeautifulSoup
+
+from .http_client import DIVING_FISH, POLICIES, http
+from .path_config import STATIC
+
+COVER_URL = f"{DIVING_FISH}/covers/"
+# 清单格式变化时递增，旧清单会被忽略
+MANIFEST_VERSION = 1
+
+
+def _parse_index(html: str) -> List[str]:
+    soup = BeautifulSoup(html, "html.parser")
+    return sorted({a["href"] for a in soup.find_all("a", href=True) if a["href"].endswith(".png")})
+
+
+class CoverSync(object):
+    """
+    封面同步。
+
+    索引页使用 ETag/Last-Modified 条件请求，未变化时直接使用清单中记录的文件列表，不再解析HTML。
+    缺失或大小与清单不符的封面以有限并发流式下载到 .part 临时文件，完成后原子重命名；
+    失败时按指数退避重试。清单记录每个文件的大小和 ETag，保存在封面目录下。
+    """
+
+    def __init__(
+        self,
+        index_url: str,
+        cover_dir: Path,
+        concurrency: int = 8,
+        retries: int = 3,
+        backoff: float = 0.5,
+    ):
+        self.index_url = index_url
+        self.cover_dir = cover_dir
+        self.manifest_path = cover_dir / ".manifest.json"
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self._lock = asyncio.Lock()
+
+    def configure(self, concurrency: Optional[int] = None, retries: Optional[int] = None):
+        if concurrency is not None:
+            self.concurrency = max(1, concurrency)
+        if retries is not None:
+            self.retries = max(0, retries)
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        try:
+            with self.manifest_path.open("r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                return manifest
+        except (OSError, ValueError):
+            pass
+        return {"version": MANIFEST_VERSION, "etag": None, "last_modified": None, "remote": [], "files": {}}
+
+    def _save_manifest(self, manifest: Dict[str, Any]):
+        tmp_path = self.manifest_path.with_name(f"{self.manifest_path.name}.{os.getpid()}.tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.manifest_path)
+
+    def _scan_local(self) -> Dict[str, int]:
+        """返回本地封面的大小，并清理上次中断留下的 .part 文件"""
+        local = {}
+        for path in self.cover_dir.iterdir():
+            if path.name.endswith(".part"):
+                path.unlink(missing_ok=True)
+            elif path.suffix == ".png":
+                local[path.name] = path.stat().st_size
+        return local
+
+    async def _fetch_index(self, manifest: Dict[str, Any]) -> Optional[List[str]]:
+        """返回远端封面列表，索引页未变化时返回 None"""
+        headers = {}
+        if manifest["remote"]:
+            if manifest["etag"]:
+                headers["If-None-Match"] = manifest["etag"]
+            if manifest["last_modified"]:
+                headers["If-Modified-Since"] = manifest["last_modified"]
+        response = await http.get(self.index_url, endpoint="covers", headers=headers)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        loop = asyncio.get_running_loop()
+        remote = await loop.run_in_executor(None, _parse_index, response.text)
+        manifest["etag"] = response.headers.get("ETag")
+        manifest["last_modified"] = response.headers.get("Last-Modified")
+        manifest["remote"] = remote
+        return remote
+
+    async def _download_once(self, name: str) -> Dict[str, Any]:
+        path = self.cover_dir / name
+        part_path = path.with_name(f"{name}.part")
+        size = 0
+        try:
+            # 并发由 sync() 中的 semaphore 控制，不占用水鱼主机的共享名额，同步期间查分请求不受影响
+            async with http.stream("GET", f"{self.index_url}{name}", endpoint="covers", host_limit=False) as response:
+                response.raise_for_status()
+                async with aiofiles.open(part_path, "wb") as f:
+                    async for chunk in response.aiter_bytes():
+                        await f.write(chunk)
+                        size += len(chunk)
+                etag = response.headers.get("ETag")
+            os.replace(part_path, path)
+        except BaseException:
+            part_path.unlink(missing_ok=True)
+            raise
+        return {"size": size, "etag": etag}
+
+    async def _download(self, name: str, semaphore: asyncio.Semaphore) -> Optional[Dict[str, Any]]:
+        retry_statuses = POLICIES["covers"].retry_statuses
+        async with semaphore:
+            attempt = 0
+            while True:
+                try:
+                    return await self._download_once(name)
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code not in retry_statuses or attempt >= self.retries:
+                        logger.error(f"下载封面失败: {name}, 状态码: {e.response.status_code}")
+                        return None
+                except (httpx.TransportError, OSError) as e:
+                    if attempt >= self.retries:
+                        logger.error(f"下载封面失败: {name}, 错误: {e!r}")
+                        return None
+                await asyncio.sleep(self.backoff * (2 ** attempt) * (1 + random.random() / 2))
+                attempt += 1
+
+    async def sync(self) -> Dict[str, Any]:
+        """同步缺失的封面，返回本次的统计信息"""
+        async with self._lock:
+            return await self._sync()
+
+    async def _sync(self) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        self.cover_dir.mkdir(parents=True, exist_ok=True)
+        manifest = await loop.run_in_executor(None, self._load_manifest)
+        local = await loop.run_in_executor(None, self._scan_local)
+
+        remote = await self._fetch_index(manifest)
+        index_changed = remote is not None
+        if remote is None:
+            remote = manifest["remote"]
+
+        files: Dict[str, Dict[str, Any]] = manifest["files"]
+        missing = [
+            name for name in remote
+            if name not in local or (name in files and files[name]["size"] != local[name])
+        ]
+        stats = {"remote": len(remote), "missing": len(missing), "downloaded": 0, "failed": 0, "bytes": 0, "seconds": 0.0}
+        if not missing:
+            if index_changed:
+                await loop.run_in_executor(None, self._save_manifest, manifest)
+            logger.info(f"所有封面文件均已为最新，无需更新。索引{'已更新' if index_changed else '未变化'}")
+            return stats
+
+        logger.info(f"发现 {len(missing)} 个缺失的封面，开始下载，并发数 {self.concurrency}")
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        last_report = started
+        tasks = [asyncio.ensure_future(self._download(name, semaphore)) for name in missing]
+        names = {task: name for task, name in zip(tasks, missing)}
+        try:
+            for done, task in enumerate(asyncio.as_completed(tasks), 1):
+                result = await task
+                if result is None:
+                    stats["failed"] += 1
+                else:
+                    stats["downloaded"] += 1
+                    stats["bytes"] += result["size"]
+                now = time.monotonic()
+                if now - last_report >= 5:
+                    elapsed = now - started
+                    logger.info(
+                        f"封面下载进度: {done}/{len(missing)}，"
+                        f"{stats['bytes'] / 1024 / 1024:.1f}MB，{stats['bytes'] / 1024 / elapsed:.0f}KB/s"
+                    )
+                    last_report = now
+        finally:
+            for task in tasks:
+                task.cancel()
+            for task in tasks:
+                if task.done() and not task.cancelled() and task.exception() is None and task.result() is not None:
+                    files[names[task]] = task.result()
+            await loop.run_in_executor(None, self._save_manifest, manifest)
+
+        elapsed = time.monotonic() - started
+        stats["seconds"] = round(elapsed, 2)
+        logger.info(
+            f"封面更新完成。成功下载 {stats['downloaded']} / {len(missing)} 个文件，"
+            f"共 {stats['bytes'] / 1024 / 1024:.1f}MB，用时 {elapsed:.1f}s，"
+            f"平均 {stats['bytes'] / 1024 / max(elapsed, 1e-6):.0f}KB/s"
+        )
+        return stats
+
+
+cover_sync = CoverSync(COVER_URL, STATIC / "mai" / "cover")
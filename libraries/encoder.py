@@ -0,0 +1,92 @@
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+FORMATS = ("png", "png8", "webp", "jpeg")
+
+_SUFFIXES = {"png": ".png", "png8": ".png", "webp": ".webp", "jpeg": ".jpg"}
+
+
+def guess_suffix(data: bytes) -> str:
+    """按文件头判断图片格式对应的扩展名，OneShot和缓存中的图片格式不一定与当前配置相同"""
+    if data[:3] == b"\xff\xd8\xff":
+        return ".jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    return ".png"
+
+
+class ImageEncoder(object):
+    """
+    B40/B50图片的输出编码。
+
+    format 可选 png（compress_level 0-9，数字越小越快、文件越大）、png8（256色调色板）、
+    webp 和 jpeg（quality 1-100）；scale 小于 1 时先按比例缩小。
+    options 是纯数据，随渲染任务一起提交到渲染进程，也是图片缓存键的一部分。
+    """
+
+    def __init__(self, format: str = "png", quality: int = 85, compress_level: int = 6, scale: float = 1.0):
+        self.format = format
+        self.quality = quality
+        self.compress_level = compress_level
+        self.scale = scale
+
+    def configure(
+        self,
+        format: Optional[str] = None,
+        quality: Optional[int] = None,
+        compress_level: Optional[int] = None,
+        scale: Optional[float] = None,
+    ):
+        if format is not None:
+            format = format.lower()
+            self.format = format if format in FORMATS else "png"
+        if quality is not None:
+            self.quality = min(100, max(1, quality))
+        if compress_level is not None:
+            self.compress_level = min(9, max(0, compress_level))
+        if scale is not None:
+            self.scale = min(1.0, max(0.1, scale))
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        return {
+            "format": self.format,
+            "quality": self.quality,
+            "compress_level": self.compress_level,
+            "scale": self.scale,
+        }
+
+    @property
+    def suffix(self) -> str:
+        return _SUFFIXES[self.format]
+
+
+def encode_image(img: Image.Image, options: Optional[Dict[str, Any]] = None) -> bytes:
+    """按编码选项把画布编码为图片数据，options 为空时与默认PNG一致"""
+    options = options or {}
+    format = options.get("format", "png")
+    scale = options.get("scale", 1.0)
+    if scale < 1:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+
+    output_buffer = BytesIO()
+    if format == "png8":
+        img = img.quantize(256, method=Image.Quantize.FASTOCTREE)
+        img.save(output_buffer, format="PNG", compress_level=options.get("compress_level", 6))
+    elif format == "webp":
+        img.save(output_buffer, format="WEBP", quality=options.get("quality", 85), method=4)
+    elif format == "jpeg":
+        # JPEG不支持透明通道，半透明部分按白底合成
+        if img.mode == "RGBA":
+            flat = Image.new("RGB", img.size, "white")
+            flat.paste(img, mask=img.split()[3])
+            img = flat
+        img.convert("RGB").save(output_buffer, format="JPEG", quality=options.get("quality", 85), optimize=True)
+    else:
+        img.save(output_buffer, format="PNG", compress_level=options.get("compress_level", 6))
+    return output_buffer.getvalue()
+
+
+image_encoder = ImageEncoder()
@@ -0,0 +1,146 @@
+import asyncio
+import importlib.util
+import random
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from astrbot.api import logger
+
+# 可在测试时指向本地桩服务器
+DIVING_FISH = "https://www.diving-fish.com"
+DXRATING = "https://miruku.dxrating.net"
+WAHLAP = "http://wc.wahlap.net"
+
+
+class RequestPolicy(object):
+    """单个接口的超时与重试策略"""
+
+    def __init__(self, timeout: float = 10.0, retries: int = 0, backoff: float = 0.5, retry_statuses=(429, 500, 502, 503, 504)):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_statuses = frozenset(retry_statuses)
+
+
+POLICIES: Dict[str, RequestPolicy] = {
+    "default": RequestPolicy(timeout=10.0, retries=1),
+    "player": RequestPolicy(timeout=10.0, retries=2),
+    "oneshot": RequestPolicy(timeout=30.0, retries=0),
+    "music_data": RequestPolicy(timeout=30.0, retries=3, backoff=1.0),
+    "location": RequestPolicy(timeout=30.0, retries=2, backoff=1.0),
+    "covers": RequestPolicy(timeout=15.0, retries=2),
+    "static": RequestPolicy(timeout=60.0, retries=0),
+}
+
+
+class HttpClient(object):
+    """
+    插件共享的HTTP客户端。
+
+    所有外部请求复用同一个 httpx.AsyncClient 的连接池（安装了 h2 时启用HTTP/2），
+    并按主机限制并发连接数。request() 按 POLICIES 中的接口策略设置超时，
+    在网络错误或可重试的状态码上按指数退避重试。transport 参数用于注入测试桩。
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 32,
+        max_keepalive: int = 16,
+        per_host: int = 8,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.per_host = per_host
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def is_open(self) -> bool:
+        return self._client is not None and not self._client.is_closed
+
+    async def open(self):
+        if self.is_open:
+            return
+        http2 = self.transport is None and importlib.util.find_spec("h2") is not None
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+            ),
+            timeout=POLICIES["default"].timeout,
+            follow_redirects=True,
+            transport=self.transport,
+        )
+        logger.info(f"HTTP客户端已启动，HTTP/2: {http2}")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._host_limits = {}
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        # 插件初始化前也可能有请求，此时按需打开
+        if not self.is_open:
+            await self.open()
+        return self._client
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = asyncio.Semaphore(self.per_host)
+            self._host_limits[host] = limit
+        return limit
+
+    async def request(self, method: str, url: str, *, endpoint: str = "default", **kwargs: Any) -> httpx.Response:
+        policy = POLICIES.get(endpoint, POLICIES["default"])
+        kwargs.setdefault("timeout", policy.timeout)
+        client = await self._get_client()
+        attempt = 0
+        while True:
+            try:
+                async with self._host_limit(url):
+                    response = await client.request(method, url, **kwargs)
+                if response.status_code not in policy.retry_statuses or attempt >= policy.retries:
+                    return response
+                logger.warning(f"{endpoint} 请求返回 {response.status_code}，准备重试")
+            except httpx.TransportError as e:
+                if attempt >= policy.retries:
+                    raise
+                logger.warning(f"{endpoint} 请求失败: {e!r}，准备重试")
+            await asyncio.sleep(policy.backoff * (2 ** attempt) * (1 + random.random() / 2))
+            attempt += 1
+
+    async def get(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(
+        self, method: str, url: str, *, endpoint: str = "default", host_limit: bool = True, **kwargs: Any
+    ) -> AsyncIterator[httpx.Response]:
+        """
+        流式请求，不做重试。
+        批量下载自行限制并发时传入 host_limit=False，不占用按主机的并发名额，以免长时间的传输阻塞同一主机上的查询请求
+        """
+        policy = POLICIES.get(endpoint, POLICIES["default"])
+        kwargs.setdefault("timeout", policy.timeout)
+        client = await self._get_client()
+        if not host_limit:
+            async with client.stream(method, url, **kwargs) as response:
+                yield response
+            return
+        async with self._host_limit(url):
+            async with client.stream(method, url, **kwargs) as response:
+                yield response
+
+
+http = HttpClient()
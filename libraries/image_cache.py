@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+
+from astrbot.api import logger
+
+from .path_config import STATIC
+
+
+def fingerprint(*parts: Any) -> str:
+    """对渲染输入做规范化序列化后取 sha256，作为图片缓存的键"""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ImageCache(object):
+    """
+    以渲染输入指纹为键的成品图片磁盘缓存。
+
+    文件保存在 cache_dir/<指纹前两位>/<指纹> 下，总大小超过 max_bytes 时按最近最少使用淘汰。
+    命中时会更新文件的修改时间，重启后仍能按修改时间恢复LRU顺序。
+    所有文件操作都在线程池中执行。
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 200 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._index: "Optional[OrderedDict[str, int]]" = None
+        self._total = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def configure(self, max_bytes: int):
+        self.max_bytes = max(0, max_bytes)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def _scan(self) -> "OrderedDict[str, int]":
+        entries = []
+        if self.cache_dir.exists():
+            for path in self.cache_dir.glob("*/*"):
+                if path.name.startswith("."):
+                    continue
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path.name, stat.st_size))
+        entries.sort()
+        return OrderedDict((name, size) for _, name, size in entries)
+
+    async def _ensure_index(self):
+        if self._index is None:
+            loop = asyncio.get_running_loop()
+            self._index = await loop.run_in_executor(None, self._scan)
+            self._total = sum(self._index.values())
+
+    def _read(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _write(self, key: str, data: bytes):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def _remove(self, keys):
+        for key in keys:
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        async with self._lock:
+            await self._ensure_index()
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self._read, key)
+        if data is None:
+            async with self._lock:
+                self._total -= self._index.pop(key, 0)
+        return data
+
+    async def put(self, key: str, data: bytes):
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write, key, data)
+        except OSError as e:
+            logger.warning(f"写入图片缓存失败: {e}")
+            return
+        async with self._lock:
+            await self._ensure_index()
+            self._total -= self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._total += len(data)
+            evicted = []
+            while self._total > self.max_bytes and self._index:
+                old_key, size = self._index.popitem(last=False)
+                self._total -= size
+                evicted.append(old_key)
+        if evicted:
+            await loop.run_in_executor(None, self._remove, evicted)
+
+    async def clear(self):
+        """清空缓存，封面或资源文件更新后已缓存的图片不再准确"""
+        async with self._lock:
+            await self._ensure_index()
+            keys = list(self._index)
+            self._index.clear()
+            self._total = 0
+        if keys:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._remove, keys)
+
+
+image_cache = ImageCache(STATIC / "image_cache")
@@ -1,23 +1,70 @@
 import math
-from pathlib import Path
+import time
+from bisect import bisect_right
 from typing import Dict, List, Any, Optional, Tuple
-import uuid
 from astrbot.api import logger
-from io import BytesIO
 
-import httpx
-from PIL import Image, ImageDraw, ImageFilter, ImageFont
+import numpy as np
+from PIL import Image, ImageDraw
 from astrbot.api import logger
 
-from .maimaidx_music import get_cover_len5_id, total_list
+from .assets import assets
+from .cache import AsyncTTLCache
+from .encoder import encode_image, image_encoder
+from .metrics import metrics
+from .image_cache import fingerprint, image_cache
+from .http_client import DIVING_FISH, DXRATING, http
+from .tile_cache import PLACEHOLDER_COVER, tile_cache
+from .maimaidx_music import ensure_initialized, get_cover_len5_id, is_music_ready
 from .path_config import STATIC
 from .models import BestList, ChartInfo, diffs
+from .score_digest import score_digest
+from .text_layout import outline_text, text_strips, truncate
 
 scoreRank = [
     "D", "C", "B", "BB", "BBB", "A", "AA", "AAA", "S", "S+", "SS", "SS+", "SSS", "SSS+",
 ]
 combo = ["", "FC", "FC+", "AP", "AP+"]
 
+# 本地绘制的版式版本，修改DrawBest的绘制结果时需要递增，使已缓存的图片失效
+TEMPLATE_VERSION = 3
+
+# 水鱼玩家成绩查询缓存，键为规范化后的查询参数
+player_cache = AsyncTTLCache(ttl=60, maxsize=256)
+
+# 最近查询过的玩家的画布状态，键与 player_cache 相同（QQ或用户名，是否B50），用于只重绘变化的卡片
+render_history = AsyncTTLCache(ttl=1800, maxsize=8)
+
+
+def player_key(payload: Dict) -> Tuple[str, str, bool]:
+    """规范化后的查询参数，同一玩家的同一种查询得到相同的键"""
+    b50 = bool(payload.get("b50"))
+    if payload.get("qq"):
+        return "qq", str(payload["qq"]).strip(), b50
+    return "username", str(payload.get("username", "")).strip(), b50
+
+
+async def query_player(payload: Dict, force: bool = False) -> Tuple[int, Optional[Dict]]:
+    """
+    查询玩家成绩，返回 (状态码, 数据)。成功的结果会按配置缓存，相同的并发查询只请求一次
+    """
+    async def fetch() -> Tuple[int, Optional[Dict]]:
+        resp = await http.post(
+            f"{DIVING_FISH}/api/maimaidxprober/query/player",
+            json=payload,
+            endpoint="player",
+        )
+        if resp.status_code != 200:
+            return resp.status_code, None
+        return 200, resp.json()
+
+    return await player_cache.get_or_fetch(
+        player_key(payload),
+        fetch,
+        force=force,
+        cacheable=lambda result: result[0] == 200,
+    )
+
 
 async def convert_chart_info_to_api_format(chart_info: ChartInfo) -> Dict[str, Any]:
     """
@@ -56,120 +103,222 @@ async def send_oneshot_request(
         }
     }
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                'https://miruku.dxrating.net/functions/render-oneshot/v0?pixelated=1',
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=30
-            )
-            if response.status_code == 200:
-                logger.info(f"OneShot图片生成成功，上传的JSON数据: {payload}")
-                return response.content
-            else:
-                logger.info(f"OneShot图片生成失败: {response.status_code}")
-                return None
+        response = await http.post(
+            f'{DXRATING}/functions/render-oneshot/v0?pixelated=1',
+            json=payload,
+            headers={'Content-Type': 'application/json'},
+            endpoint="oneshot",
+        )
+        if response.status_code == 200:
+            logger.info(f"OneShot图片生成成功，上传的JSON数据: {payload}")
+            return response.content
+        else:
+            logger.info(f"OneShot图片生成失败: {response.status_code}")
+            return None
     except Exception as e:
         logger.error(f"OneShot图片生成异常: {e}")
         return None
 
 
-async def generate_oneshot_data(
+async def _oneshot_entries(sd_best: BestList, dx_best: BestList) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    b15_data = [await convert_chart_info_to_api_format(chart) for chart in dx_best]
+    b35_data = [await convert_chart_info_to_api_format(chart) for chart in sd_best]
+    return b15_data, b35_data
+
+
+async def cached_oneshot_data(
     sd_best: BestList,
     dx_best: BestList,
     version: str = "PRiSM",
     region: str = "cn"
 ) -> Optional[bytes]:
     """
-    生成OneShot图片数据并发送请求
+    只查询图片缓存中的OneShot图片，不发送请求
     """
-    b15_data = [await convert_chart_info_to_api_format(chart) for chart in dx_best]
-    b35_data = [await convert_chart_info_to_api_format(chart) for chart in sd_best]
-    return await send_oneshot_request(version, region, b15_data, b35_data)
+    b15_data, b35_data = await _oneshot_entries(sd_best, dx_best)
+    return await image_cache.get(fingerprint("oneshot", version, region, b15_data, b35_data))
 
 
-async def save_oneshot_image_to_tmp(oneshot_data: bytes) -> Optional[str]:
+async def generate_oneshot_data(
+    sd_best: BestList,
+    dx_best: BestList,
+    version: str = "PRiSM",
+    region: str = "cn",
+    use_cache: bool = True,
+) -> Optional[bytes]:
     """
-    将oneshot图片数据保存到临时文件并返回路径
+    生成OneShot图片数据并发送请求，use_cache=False 时跳过缓存查询直接请求，结果仍会写入缓存
     """
-    if not oneshot_data:
-        return None
-    try:
-        tmp_dir = STATIC / "tmp"
-        tmp_dir.mkdir(exist_ok=True)
-        tmp_path = tmp_dir / f"{uuid.uuid4()}.png"
-        with open(tmp_path, "wb") as f:
-            f.write(oneshot_data)
-        return str(tmp_path)
-    except Exception as e:
-        logger.error(f"保存OneShot图片到临时文件失败: {e}")
-        return None
+    b15_data, b35_data = await _oneshot_entries(sd_best, dx_best)
+    cache_key = fingerprint("oneshot", version, region, b15_data, b35_data)
+    if use_cache:
+        cached = await image_cache.get(cache_key)
+        if cached:
+            logger.info("OneShot图片命中缓存")
+            return cached
+    data = await send_oneshot_request(version, region, b15_data, b35_data)
+    if data:
+        await image_cache.put(cache_key, data)
+    return data
+
+
+async def parse_best_lists(obj: Dict, is_b50: bool = False) -> Tuple[BestList, BestList]:
+    """
+    将水鱼返回的成绩解析为旧版本(SD)和新版本(DX)的最佳成绩列表
+    """
+    sd: List[Dict] = obj["charts"]["sd"]
+    dx: List[Dict] = obj["charts"]["dx"]
+    if not is_music_ready():
+        await ensure_initialized()
+    sd_best = BestList.from_records(ChartInfo.from_records(sd), 35 if is_b50 else 25)
+    dx_best = BestList.from_records(ChartInfo.from_records(dx), 15)
+    assign_ratings(list(sd_best) + list(dx_best), is_b50)
+    return sd_best, dx_best
 
 
-async def handle_oneshot_command(payload: Dict, is_b50: bool = False) -> Optional[Tuple[str, str]]:
+def format_score_text(obj: Dict, sd_best: BestList, dx_best: BestList, is_b50: bool = False) -> str:
     """
-    处理oneshot命令，生成并返回oneshot图片路径和成绩文本
+    生成逐条列出最佳成绩的文本，用于AI锐评
     """
-    try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                "https://www.diving-fish.com/api/maimaidxprober/query/player",
-                json=payload,
-            )
-            if resp.status_code != 200:
-                return None
-            obj = resp.json()
+    nickname = obj["nickname"]
+    sd_rating = sum(c.rating for c in sd_best)
+    dx_rating = sum(c.rating for c in dx_best)
+    text_result = f"玩家: {nickname}\n"
+    if is_b50:
+        total_rating = sd_rating + dx_rating
+        text_result += f"Rating: {total_rating} (SD: {sd_rating} + DX: {dx_rating})\n\n"
+        text_result += "--- SD Best (B35) ---\n"
+    else:
+        rating = obj["rating"]
+        additional_rating = obj["additional_rating"]
+        total_rating = rating + additional_rating
+        text_result += f"Rating: {total_rating} (底分: {rating} + 段位分: {additional_rating})\n\n"
+        text_result += "--- SD Best (B25) ---\n"
+    for i, chart in enumerate(sd_best):
+        text_result += f"#{i+1}: {chart.title} [{diffs[chart.diff]}] | DS: {chart.ds:.1f}, Ach: {chart.achievement:.4f}%, RA: {chart.rating}\n"
+    text_result += "\n--- DX Best (B15) ---\n"
+    for i, chart in enumerate(dx_best):
+        text_result += f"#{i+1}: {chart.title} [{diffs[chart.diff]}] | DS: {chart.ds:.1f}, Ach: {chart.achievement:.4f}%, RA: {chart.rating}\n"
+    return text_result
 
-        nickname = obj["nickname"]
 
-        if is_b50:
-            sd_best = BestList(35)
-            dx_best = BestList(15)
-        else:
-            sd_best = BestList(25)
-            dx_best = BestList(15)
+def build_score_text(obj: Dict, sd_best: BestList, dx_best: BestList, is_b50: bool = False) -> str:
+    """按配置生成交给AI锐评的成绩文本：逐条列出或统计摘要"""
+    if score_digest.enabled:
+        return score_digest.render(obj, sd_best, dx_best, is_b50)
+    return format_score_text(obj, sd_best, dx_best, is_b50)
 
-        dx: List[Dict] = obj["charts"]["dx"]
-        sd: List[Dict] = obj["charts"]["sd"]
-        for c in sd:
-            sd_best.push(await ChartInfo.from_json(c))
-        for c in dx:
-            dx_best.push(await ChartInfo.from_json(c))
 
-        if is_b50:
-            sd_rating = sum(computeRa(c.ds, c.achievement, is_b50) for c in sd_best)
-            dx_rating = sum(computeRa(c.ds, c.achievement, is_b50) for c in dx_best)
-            total_rating = sd_rating + dx_rating
-            text_result = f"玩家: {nickname}\n"
-            text_result += f"Rating: {total_rating} (SD: {sd_rating} + DX: {dx_rating})\n\n"
-            text_result += "--- SD Best (B35) ---\n"
-            for i, chart in enumerate(sd_best):
-                text_result += f"#{i+1}: {chart.title} [{diffs[chart.diff]}] | DS: {chart.ds:.1f}, Ach: {chart.achievement:.4f}%, RA: {computeRa(chart.ds, chart.achievement, is_b50)}\n"
-            text_result += "\n--- DX Best (B15) ---\n"
-            for i, chart in enumerate(dx_best):
-                text_result += f"#{i+1}: {chart.title} [{diffs[chart.diff]}] | DS: {chart.ds:.1f}, Ach: {chart.achievement:.4f}%, RA: {computeRa(chart.ds, chart.achievement, is_b50)}\n"
-        else:
-            rating = obj["rating"]
-            additional_rating = obj["additional_rating"]
-            total_rating = rating + additional_rating
-            text_result = f"玩家: {nickname}\n"
-            text_result += f"Rating: {total_rating} (底分: {rating} + 段位分: {additional_rating})\n\n"
-            text_result += "--- SD Best (B25) ---\n"
-            for i, chart in enumerate(sd_best):
-                text_result += f"#{i+1}: {chart.title} [{diffs[chart.diff]}] | DS: {chart.ds:.1f}, Ach: {chart.achievement:.4f}%, RA: {chart.ra}\n"
-            text_result += "\n--- DX Best (B15) ---\n"
-            for i, chart in enumerate(dx_best):
-                text_result += f"#{i+1}: {chart.title} [{diffs[chart.diff]}] | DS: {chart.ds:.1f}, Ach: {chart.achievement:.4f}%, RA: {chart.ra}\n"
-        
-        oneshot_data = await generate_oneshot_data(sd_best, dx_best, "PRiSM", "cn")
-        if oneshot_data:
-            tmp_path = await save_oneshot_image_to_tmp(oneshot_data)
-            if tmp_path:
-                return tmp_path, text_result
-    except Exception as e:
-        logger.error(f"处理oneshot命令时出错: {e}")
-        raise e
-    return None
+class SectionSpec(object):
+    """成绩区（SD 或 DX）的卡片排布：起始横坐标、每行张数、标题截断规则和显示的单曲Rating字段"""
+
+    __slots__ = ("origin_x", "per_row", "title_limit", "title_cut", "ra_field")
+
+    def __init__(self, origin_x: int, per_row: int, title_limit: int, title_cut: int, ra_field: str):
+        self.origin_x = origin_x
+        self.per_row = per_row
+        self.title_limit = title_limit
+        self.title_cut = title_cut
+        self.ra_field = ra_field
+
+
+class LayoutSpec(object):
+    """B50/B40 的版式：卡片尺寸和网格、卡片内元素位置以及 SD/DX 标志的位置"""
+
+    __slots__ = ("name", "item_size", "col_pitch", "row_origin", "row_pitch", "sd", "dx", "ach_font", "rank_x", "combo_x", "sd_badge", "dx_badge")
+
+    def __init__(
+        self,
+        name: str,
+        item_size: Tuple[int, int],
+        col_pitch: int,
+        sd: SectionSpec,
+        dx: SectionSpec,
+        ach_font: int,
+        rank_x: int,
+        combo_x: int,
+        sd_badge: Tuple[int, int],
+        dx_badge: Tuple[int, int],
+        row_origin: int = 116,
+        row_pitch: int = 96,
+    ):
+        self.name = name
+        self.item_size = item_size
+        self.col_pitch = col_pitch
+        self.row_origin = row_origin
+        self.row_pitch = row_pitch
+        self.sd = sd
+        self.dx = dx
+        self.ach_font = ach_font
+        self.rank_x = rank_x
+        self.combo_x = combo_x
+        self.sd_badge = sd_badge
+        self.dx_badge = dx_badge
+
+    def slot(self, section: SectionSpec, num: int) -> Tuple[int, int]:
+        """第 num 张卡片所在格子的左上角"""
+        i, j = divmod(num, section.per_row)
+        return section.origin_x + self.col_pitch * j, self.row_origin + self.row_pitch * i
+
+
+LAYOUTS: Dict[bool, LayoutSpec] = {
+    True: LayoutSpec(
+        "b50", (131, 88), 138,
+        sd=SectionSpec(2, 7, title_limit=15, title_cut=12, ra_field="rating"),
+        dx=SectionSpec(988, 3, title_limit=13, title_cut=12, ra_field="ra"),
+        ach_font=12, rank_x=72, combo_x=103, sd_badge=(865, 65), dx_badge=(988, 65),
+    ),
+    False: LayoutSpec(
+        "b40", (164, 88), 172,
+        sd=SectionSpec(2, 5, title_limit=15, title_cut=14, ra_field="ra"),
+        dx=SectionSpec(888, 3, title_limit=15, title_cut=14, ra_field="ra"),
+        ach_font=14, rank_x=88, combo_x=119, sd_badge=(758, 65), dx_badge=(890, 65),
+    ),
+}
+
+TILE_COLORS = [(69, 193, 36), (255, 186, 1), (255, 90, 102), (134, 49, 200), (217, 197, 233)]
+RANK_PICS = ["D", "C", "B", "BB", "BBB", "A", "AA", "AAA", "S", "Sp", "SS", "SSp", "SSS", "SSSp"]
+COMBO_PICS = ["", "FC", "FCp", "AP", "APp"]
+TITLE_FONT = "adobe_simhei.otf"
+
+
+def _build_template(layout: LayoutSpec) -> Tuple[Image.Image, Image.Image, List[Tuple[Image.Image, Tuple[int, int]]]]:
+    """
+    预先合成版式中不随成绩变化的部分：
+    底图（背景和标题logo）、卡片阴影，以及需要盖在卡片之上的作者框和 SD/DX 标志
+    """
+    base = assets.sprite_copy("UI_TTR_BG_Base_Plus.png")
+    splashLogo = assets.sprite("UI_CMN_TabTitle_MaimaiTitle_Ver214.png", 0.65)
+    base.paste(splashLogo, (10, 10), mask=splashLogo.split()[3])
+
+    shadow = Image.new("RGBA", layout.item_size, "black").point(lambda p: int(p * 0.8))
+
+    authorBoardImg = assets.sprite_copy("UI_CMN_MiniDialog_01.png", 0.35)
+    authorBoardDraw = ImageDraw.Draw(authorBoardImg)
+    authorBoardDraw.text((31, 28), "   Generated By\nXybBot & Chiyuki", "black", assets.font(TITLE_FONT, 14))
+    overlay = [
+        (authorBoardImg, (1224, 19)),
+        (assets.sprite("UI_RSL_MBase_Parts_01.png"), layout.dx_badge),
+        (assets.sprite("UI_RSL_MBase_Parts_02.png"), layout.sd_badge),
+    ]
+    return base, shadow, overlay
+
+
+def get_template(layout: LayoutSpec):
+    return assets.composite(("template", layout.name), lambda: _build_template(layout))
+
+
+def _opBox(op: Tuple[Image.Image, Tuple[int, int], bool]) -> Tuple[int, int, int, int]:
+    part, (x, y), _ = op
+    return x, y, x + part.size[0], y + part.size[1]
+
+
+def _union(boxes: List[Tuple[int, int, int, int]]) -> Tuple[int, int, int, int]:
+    return min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)
+
+
+def _intersects(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
 
 
 class DrawBest(object):
@@ -181,6 +330,7 @@ class DrawBest(object):
         playerRating: int,
         musicRating: int,
         is_b50: bool = False,
+        previous: Optional[Dict[str, Any]] = None,
     ):
         self.sdBest = sdBest
         self.dxBest = dxBest
@@ -189,32 +339,30 @@ class DrawBest(object):
         self.musicRating = musicRating
         self.rankRating = self.playerRating - self.musicRating
         self.is_b50 = is_b50
+        self.sdRating = self.dxRating = None
         if is_b50:
-            self.sdRating = 0
-            self.dxRating = 0
-            for sd in sdBest:
-                self.sdRating += computeRa(sd.ds, sd.achievement, is_b50)
-            for dx in dxBest:
-                self.dxRating += computeRa(dx.ds, dx.achievement, is_b50)
+            assign_ratings([c for c in list(sdBest) + list(dxBest) if c.rating is None], is_b50)
+            self.sdRating = sum(sd.rating for sd in sdBest)
+            self.dxRating = sum(dx.rating for dx in dxBest)
             self.playerRating = self.sdRating + self.dxRating
         self.pic_dir = STATIC / "mai" / "pic"
         self.cover_dir = STATIC / "mai" / "cover"
-        self.img = Image.open(self.pic_dir / "UI_TTR_BG_Base_Plus.png").convert("RGBA")
-        self.ROWS_IMG = [2]
-        for i in range(6):
-            self.ROWS_IMG.append(116 + 96 * i)
-        self.COLOUMS_IMG = []
-        if is_b50:
-            for i in range(8):
-                self.COLOUMS_IMG.append(2 + 138 * i)
-            for i in range(4):
-                self.COLOUMS_IMG.append(988 + 138 * i)
+        self.layout = LAYOUTS[is_b50]
+        self.base, self.shadow, self.overlay = get_template(self.layout)
+        self.slots = [
+            (section, num, best[num] if num < len(best) else None)
+            for section, best in ((self.layout.sd, sdBest), (self.layout.dx, dxBest))
+            for num in range(best.size)
+        ]
+        self.header = (self.userName, self.playerRating, self.musicRating, self.rankRating, self.sdRating, self.dxRating)
+        self.headerBox: Optional[Tuple[int, int, int, int]] = None
+        self.changed = len(self.slots) + 1
+        if self._canReuse(previous):
+            self.img = Image.frombytes(previous["mode"], previous["size"], previous["canvas"])
+            self.redraw(previous)
         else:
-            for i in range(6):
-                self.COLOUMS_IMG.append(2 + 172 * i)
-            for i in range(4):
-                self.COLOUMS_IMG.append(888 + 172 * i)
-        self.draw()
+            self.img = self.base.copy()
+            self.draw()
 
     def _Q2B(self, uchar):
         inside_code = ord(uchar)
@@ -229,32 +377,6 @@ class DrawBest(object):
     def _stringQ2B(self, ustring):
         return "".join([self._Q2B(uchar) for uchar in ustring])
 
-    def _getCharWidth(self, o) -> int:
-        widths = [
-            (126, 1), (159, 0), (687, 1), (710, 0), (711, 1), (727, 0), (733, 1), (879, 0), (1154, 1), (1161, 0), (4347, 1), (4447, 2), (7467, 1), (7521, 0), (8369, 1), (8426, 0), (9000, 1), (9002, 2), (11021, 1), (12350, 2), (12351, 1), (12438, 2), (12442, 0), (19893, 2), (19967, 1), (55203, 2), (63743, 1), (64106, 2), (65039, 1), (65059, 0), (65131, 2), (65279, 1), (65376, 2), (65500, 1), (65510, 2), (120831, 1), (262141, 2), (1114109, 1),
-        ]
-        if o == 0xE or o == 0xF:
-            return 0
-        for num, wid in widths:
-            if o <= num:
-                return wid
-        return 1
-
-    def _coloumWidth(self, s: str):
-        res = 0
-        for ch in s:
-            res += self._getCharWidth(ord(ch))
-        return res
-
-    def _changeColumnWidth(self, s: str, lens: int) -> str:
-        res = 0
-        sList = []
-        for ch in s:
-            res += self._getCharWidth(ord(ch))
-            if res <= lens:
-                sList.append(ch)
-        return "".join(sList)
-
     def _resizePic(self, img: Image.Image, time: float):
         return img.resize((int(img.size[0] * time), int(img.size[1] * time)))
 
@@ -291,164 +413,26 @@ class DrawBest(object):
         while theRa:
             digit = theRa % 10
             theRa = theRa // 10
-            digitImg = Image.open(self.pic_dir / f"UI_NUM_Drating_{digit}.png").convert("RGBA")
-            digitImg = self._resizePic(digitImg, 0.6)
+            digitImg = assets.sprite(f"UI_NUM_Drating_{digit}.png", 0.6)
             ratingBaseImg.paste(digitImg, (COLOUMS_RATING[i] - 2, 9), mask=digitImg.split()[3])
             i = i - 1
         return ratingBaseImg
 
-    def _drawBestList(self, img: Image.Image, sdBest: BestList, dxBest: BestList):
-        if self.is_b50: itemW, itemH = 131, 88
-        else: itemW, itemH = 164, 88
-        Color = [(69, 193, 36), (255, 186, 1), (255, 90, 102), (134, 49, 200), (217, 197, 233)]
-        levelTriagle = [(itemW, 0), (itemW - 27, 0), (itemW, 27)]
-        rankPic = ["D", "C", "B", "BB", "BBB", "A", "AA", "AAA", "S", "Sp", "SS", "SSp", "SSS", "SSSp"]
-        comboPic = ["", "FC", "FCp", "AP", "APp"]
-        titleFontName = str(STATIC / "adobe_simhei.otf")
-
-        for num, chartInfo in enumerate(sdBest):
-            if self.is_b50: i, j = num // 7, num % 7
-            else: i, j = num // 5, num % 5
-            
-            pngPath = self.cover_dir / f"{get_cover_len5_id(chartInfo.idNum)}.png"
-            if not pngPath.is_file(): pngPath = self.cover_dir / "01000.png"
-            
-            with Image.open(pngPath).convert("RGB") as temp:
-                temp = self._resizePic(temp, itemW / temp.size[0])
-                temp = temp.crop((0, (temp.size[1] - itemH) / 2, itemW, (temp.size[1] + itemH) / 2))
-                temp = temp.filter(ImageFilter.GaussianBlur(3)).point(lambda p: int(p * 0.72))
-                tempDraw = ImageDraw.Draw(temp)
-                tempDraw.polygon(levelTriagle, Color[chartInfo.diff])
-                
-                title = chartInfo.title
-                if self.is_b50:
-                    font = ImageFont.truetype(titleFontName, 16, encoding="utf-8")
-                    if self._coloumWidth(title) > 15: title = self._changeColumnWidth(title, 12) + "..."
-                    tempDraw.text((8, 8), title, "white", font)
-                    font = ImageFont.truetype(titleFontName, 12, encoding="utf-8")
-                else:
-                    font = ImageFont.truetype(titleFontName, 16, encoding="utf-8")
-                    if self._coloumWidth(title) > 15: title = self._changeColumnWidth(title, 14) + "..."
-                    tempDraw.text((8, 8), title, "white", font)
-                    font = ImageFont.truetype(titleFontName, 14, encoding="utf-8")
-
-                tempDraw.text((7, 28), f'{"%.4f" % chartInfo.achievement}%', "white", font)
-                
-                with Image.open(self.pic_dir / f"UI_GAM_Rank_{rankPic[chartInfo.scoreId]}.png").convert("RGBA") as rankImg:
-                    rankImg = self._resizePic(rankImg, 0.3)
-                    temp.paste(rankImg, (88 if not self.is_b50 else 72, 28), rankImg.split()[3])
-
-                if chartInfo.comboId:
-                    with Image.open(self.pic_dir / f"UI_MSS_MBase_Icon_{comboPic[chartInfo.comboId]}_S.png").convert("RGBA") as comboImg:
-                        comboImg = self._resizePic(comboImg, 0.45)
-                        temp.paste(comboImg, (119 if not self.is_b50 else 103, 27), comboImg.split()[3])
-
-                font = ImageFont.truetype(str(STATIC / "adobe_simhei.otf"), 12, encoding="utf-8")
-                ra_text = f"Base: {chartInfo.ds} -> {computeRa(chartInfo.ds, chartInfo.achievement, self.is_b50)}" if self.is_b50 else f"Base: {chartInfo.ds} -> {chartInfo.ra}"
-                tempDraw.text((8, 44), ra_text, "white", font)
-                
-                font = ImageFont.truetype(str(STATIC / "adobe_simhei.otf"), 18, encoding="utf-8")
-                tempDraw.text((8, 60), f"#{num + 1}", "white", font)
-
-                recBase = Image.new("RGBA", (itemW, itemH), "black").point(lambda p: int(p * 0.8))
-                img.paste(recBase, (self.COLOUMS_IMG[j] + 5, self.ROWS_IMG[i + 1] + 5))
-                img.paste(temp, (self.COLOUMS_IMG[j] + 4, self.ROWS_IMG[i + 1] + 4))
-
-        for num in range(len(sdBest), sdBest.size):
-            if self.is_b50: i, j = num // 7, num % 7
-            else: i, j = num // 5, num % 5
-            with Image.open(self.cover_dir / "01000.png").convert("RGB") as temp:
-                temp = self._resizePic(temp, itemW / temp.size[0])
-                temp = temp.crop((0, (temp.size[1] - itemH) / 2, itemW, (temp.size[1] + itemH) / 2))
-                temp = temp.filter(ImageFilter.GaussianBlur(1))
-                img.paste(temp, (self.COLOUMS_IMG[j] + 4, self.ROWS_IMG[i + 1] + 4))
-
-        for num, chartInfo in enumerate(dxBest):
-            if self.is_b50: i, j = num // 3, num % 3
-            else: i, j = num // 3, num % 3
-            
-            pngPath = self.cover_dir / f"{get_cover_len5_id(chartInfo.idNum)}.png"
-            if not pngPath.is_file(): pngPath = self.cover_dir / "01000.png"
-            
-            with Image.open(pngPath).convert("RGB") as temp:
-                temp = self._resizePic(temp, itemW / temp.size[0])
-                temp = temp.crop((0, (temp.size[1] - itemH) / 2, itemW, (temp.size[1] + itemH) / 2))
-                temp = temp.filter(ImageFilter.GaussianBlur(3)).point(lambda p: int(p * 0.72))
-                tempDraw = ImageDraw.Draw(temp)
-                tempDraw.polygon(levelTriagle, Color[chartInfo.diff])
-                
-                title = chartInfo.title
-                if self.is_b50:
-                    font = ImageFont.truetype(titleFontName, 16, encoding="utf-8")
-                    if self._coloumWidth(title) > 13: title = self._changeColumnWidth(title, 12) + "..."
-                else:
-                    font = ImageFont.truetype(titleFontName, 16, encoding="utf-8")
-                    if self._coloumWidth(title) > 15: title = self._changeColumnWidth(title, 14) + "..."
-                tempDraw.text((8, 8), title, "white", font)
-                
-                if self.is_b50: font = ImageFont.truetype(titleFontName, 12, encoding="utf-8")
-                else: font = ImageFont.truetype(titleFontName, 14, encoding="utf-8")
-                
-                tempDraw.text((7, 28), f'{"%.4f" % chartInfo.achievement}%', "white", font)
-                
-                with Image.open(self.pic_dir / f"UI_GAM_Rank_{rankPic[chartInfo.scoreId]}.png").convert("RGBA") as rankImg:
-                    rankImg = self._resizePic(rankImg, 0.3)
-                    temp.paste(rankImg, (88 if not self.is_b50 else 72, 28), rankImg.split()[3])
-
-                if chartInfo.comboId:
-                    with Image.open(self.pic_dir / f"UI_MSS_MBase_Icon_{comboPic[chartInfo.comboId]}_S.png").convert("RGBA") as comboImg:
-                        comboImg = self._resizePic(comboImg, 0.45)
-                        temp.paste(comboImg, (119 if not self.is_b50 else 103, 27), comboImg.split()[3])
-
-                font = ImageFont.truetype(str(STATIC / "adobe_simhei.otf"), 12, encoding="utf-8")
-                tempDraw.text((8, 44), f"Base: {chartInfo.ds} -> {chartInfo.ra}", "white", font)
-                
-                font = ImageFont.truetype(str(STATIC / "adobe_simhei.otf"), 18, encoding="utf-8")
-                tempDraw.text((8, 60), f"#{num + 1}", "white", font)
-
-                recBase = Image.new("RGBA", (itemW, itemH), "black").point(lambda p: int(p * 0.8))
-                if self.is_b50:
-                    img.paste(recBase, (self.COLOUMS_IMG[j + 8] + 5, self.ROWS_IMG[i + 1] + 5))
-                    img.paste(temp, (self.COLOUMS_IMG[j + 8] + 4, self.ROWS_IMG[i + 1] + 4))
-                else:
-                    img.paste(recBase, (self.COLOUMS_IMG[j + 6] + 5, self.ROWS_IMG[i + 1] + 5))
-                    img.paste(temp, (self.COLOUMS_IMG[j + 6] + 4, self.ROWS_IMG[i + 1] + 4))
-        
-        for num in range(len(dxBest), dxBest.size):
-            if self.is_b50: i, j = num // 3, num % 3
-            else: i, j = num // 3, num % 3
-            with Image.open(self.cover_dir / "01000.png").convert("RGB") as temp:
-                temp = self._resizePic(temp, itemW / temp.size[0])
-                temp = temp.crop((0, (temp.size[1] - itemH) / 2, itemW, (temp.size[1] + itemH) / 2))
-                temp = temp.filter(ImageFilter.GaussianBlur(1))
-                if self.is_b50:
-                    img.paste(temp, (self.COLOUMS_IMG[j + 8] + 4, self.ROWS_IMG[i + 1] + 4))
-                else:
-                    img.paste(temp, (self.COLOUMS_IMG[j + 6] + 4, self.ROWS_IMG[i + 1] + 4))
-
-    def draw(self):
-        splashLogo = Image.open(self.pic_dir / "UI_CMN_TabTitle_MaimaiTitle_Ver214.png").convert("RGBA")
-        splashLogo = self._resizePic(splashLogo, 0.65)
-        self.img.paste(splashLogo, (10, 10), mask=splashLogo.split()[3])
-
-        ratingBaseImg = Image.open(self.pic_dir / self._findRaPic()).convert("RGBA")
+    def _headerOps(self) -> List[Tuple[Image.Image, Tuple[int, int], bool]]:
+        ratingBaseImg = assets.sprite_copy(self._findRaPic())
         ratingBaseImg = self._drawRating(ratingBaseImg)
         ratingBaseImg = self._resizePic(ratingBaseImg, 0.85)
-        self.img.paste(ratingBaseImg, (240, 8), mask=ratingBaseImg.split()[3])
 
-        namePlateImg = Image.open(self.pic_dir / "UI_TST_PlateMask.png").convert("RGBA")
-        namePlateImg = namePlateImg.resize((285, 40))
+        namePlateImg = assets.sprite_copy("UI_TST_PlateMask.png", size=(285, 40))
         namePlateDraw = ImageDraw.Draw(namePlateImg)
-        font1 = ImageFont.truetype(str(STATIC / "msyh.ttc"), 28, encoding="unic")
+        font1 = assets.font("msyh.ttc", 28, encoding="unic")
         namePlateDraw.text((12, 4), " ".join(list(self.userName)), "black", font1)
-        nameDxImg = Image.open(self.pic_dir / "UI_CMN_Name_DX.png").convert("RGBA")
-        nameDxImg = self._resizePic(nameDxImg, 0.9)
+        nameDxImg = assets.sprite("UI_CMN_Name_DX.png", 0.9)
         namePlateImg.paste(nameDxImg, (230, 4), mask=nameDxImg.split()[3])
-        self.img.paste(namePlateImg, (240, 40), mask=namePlateImg.split()[3])
 
-        shougouImg = Image.open(self.pic_dir / "UI_CMN_Shougou_Rainbow.png").convert("RGBA")
+        shougouImg = assets.sprite_copy("UI_CMN_Shougou_Rainbow.png")
         shougouDraw = ImageDraw.Draw(shougouImg)
-        font2 = ImageFont.truetype(str(STATIC / "adobe_simhei.otf"), 14, encoding="utf-8")
+        font2 = assets.font("adobe_simhei.otf", 14)
         if self.is_b50:
             playCountInfo = f"SD: {self.sdRating} + DX: {self.dxRating} = {self.playerRating}"
         else:
@@ -457,132 +441,294 @@ class DrawBest(object):
         bbox = shougouDraw.textbbox((0, 0), playCountInfo, font2)
         playCountInfoW, _ = bbox[2] - bbox[0], bbox[3] - bbox[1]
         textPos = ((shougouImgW - playCountInfoW) / 2, 5)
-        shougouDraw.text((textPos[0] - 1, textPos[1]), playCountInfo, "black", font2)
-        shougouDraw.text((textPos[0] + 1, textPos[1]), playCountInfo, "black", font2)
-        shougouDraw.text((textPos[0], textPos[1] - 1), playCountInfo, "black", font2)
-        shougouDraw.text((textPos[0], textPos[1] + 1), playCountInfo, "black", font2)
-        shougouDraw.text((textPos[0] - 1, textPos[1] - 1), playCountInfo, "black", font2)
-        shougouDraw.text((textPos[0] + 1, textPos[1] - 1), playCountInfo, "black", font2)
-        shougouDraw.text((textPos[0] - 1, textPos[1] + 1), playCountInfo, "black", font2)
-        shougouDraw.text((textPos[0] + 1, textPos[1] + 1), playCountInfo, "black", font2)
-        shougouDraw.text(textPos, playCountInfo, "white", font2)
+        outline_text(shougouDraw, textPos, playCountInfo, font2)
         shougouImg = self._resizePic(shougouImg, 1.05)
-        self.img.paste(shougouImg, (240, 83), mask=shougouImg.split()[3])
 
-        self._drawBestList(self.img, self.sdBest, self.dxBest)
+        ops = [(ratingBaseImg, (240, 8), True), (namePlateImg, (240, 40), True), (shougouImg, (240, 83), True)]
+        self.headerBox = _union([_opBox(op) for op in ops])
+        return ops
+
+    def _tile(self, chartInfo: ChartInfo, num: int, section: SectionSpec) -> Image.Image:
+        layout = self.layout
+        itemW, itemH = layout.item_size
+        temp = tile_cache.get(get_cover_len5_id(chartInfo.idNum), itemW, itemH).copy()
+        tempDraw = ImageDraw.Draw(temp)
+        tempDraw.polygon([(itemW, 0), (itemW - 27, 0), (itemW, 27)], TILE_COLORS[chartInfo.diff])
+
+        title = truncate(chartInfo.title, section.title_limit, section.title_cut)
+        text_strips.paste(temp, (8, 8), title, assets.font(TITLE_FONT, 16))
+        tempDraw.text((7, 28), f'{"%.4f" % chartInfo.achievement}%', "white", assets.font(TITLE_FONT, layout.ach_font))
+
+        rankImg = assets.sprite(f"UI_GAM_Rank_{RANK_PICS[chartInfo.scoreId]}.png", 0.3)
+        temp.paste(rankImg, (layout.rank_x, 28), rankImg.split()[3])
+        if chartInfo.comboId:
+            comboImg = assets.sprite(f"UI_MSS_MBase_Icon_{COMBO_PICS[chartInfo.comboId]}_S.png", 0.45)
+            temp.paste(comboImg, (layout.combo_x, 27), comboImg.split()[3])
+
+        ra = getattr(chartInfo, section.ra_field)
+        tempDraw.text((8, 44), f"Base: {chartInfo.ds} -> {ra}", "white", assets.font(TITLE_FONT, 12))
+        tempDraw.text((8, 60), f"#{num + 1}", "white", assets.font(TITLE_FONT, 18))
+        return temp
+
+    def _slotOps(self, section: SectionSpec, num: int, chartInfo: Optional[ChartInfo]) -> List[Tuple[Image.Image, Tuple[int, int], bool]]:
+        x, y = self.layout.slot(section, num)
+        if chartInfo is None:
+            itemW, itemH = self.layout.item_size
+            return [(tile_cache.get(PLACEHOLDER_COVER, itemW, itemH, placeholder=True), (x + 4, y + 4), False)]
+        return [(self.shadow, (x + 5, y + 5), False), (self._tile(chartInfo, num, section), (x + 4, y + 4), False)]
+
+    def _slotBox(self, section: SectionSpec, num: int) -> Tuple[int, int, int, int]:
+        x, y = self.layout.slot(section, num)
+        itemW, itemH = self.layout.item_size
+        return x + 4, y + 4, x + 5 + itemW, y + 5 + itemH
+
+    @staticmethod
+    def _slotKey(section: SectionSpec, chartInfo: Optional[ChartInfo]) -> Optional[Tuple]:
+        """卡片内容的指纹，包括实际使用的封面，卡片位置由它在列表中的下标决定"""
+        if chartInfo is None:
+            return None
+        return (
+            tile_cache.resolve(get_cover_len5_id(chartInfo.idNum)), chartInfo.idNum, chartInfo.diff, chartInfo.title, chartInfo.achievement,
+            chartInfo.scoreId, chartInfo.comboId, chartInfo.ds, getattr(chartInfo, section.ra_field),
+        )
 
-        authorBoardImg = Image.open(self.pic_dir / "UI_CMN_MiniDialog_01.png").convert("RGBA")
-        authorBoardImg = self._resizePic(authorBoardImg, 0.35)
-        authorBoardDraw = ImageDraw.Draw(authorBoardImg)
-        authorBoardDraw.text((31, 28), "   Generated By\nXybBot & Chiyuki", "black", font2)
-        self.img.paste(authorBoardImg, (1224, 19), mask=authorBoardImg.split()[3])
+    @staticmethod
+    def _apply(img: Image.Image, op: Tuple[Image.Image, Tuple[int, int], bool], dx: int = 0, dy: int = 0):
+        part, (x, y), masked = op
+        img.paste(part, (x - dx, y - dy), mask=part.split()[3] if masked else None)
 
-        dxImg = Image.open(self.pic_dir / "UI_RSL_MBase_Parts_01.png").convert("RGBA")
-        if self.is_b50:
-            self.img.paste(dxImg, (988, 65), mask=dxImg.split()[3])
-            sdImg = Image.open(self.pic_dir / "UI_RSL_MBase_Parts_02.png").convert("RGBA")
-            self.img.paste(sdImg, (865, 65), mask=sdImg.split()[3])
+    def draw(self):
+        for op in self._headerOps():
+            self._apply(self.img, op)
+        for section, num, chartInfo in self.slots:
+            for op in self._slotOps(section, num, chartInfo):
+                self._apply(self.img, op)
+        for part, pos in self.overlay:
+            self._apply(self.img, (part, pos, True))
+
+    def _canReuse(self, previous: Optional[Dict[str, Any]]) -> bool:
+        return (
+            previous is not None
+            and previous.get("version") == TEMPLATE_VERSION
+            and previous.get("layout") == self.layout.name
+            and len(previous.get("slots", ())) == len(self.slots)
+        )
+
+    def redraw(self, previous: Dict[str, Any]):
+        """
+        在上一次的画布上只重新合成发生变化的区域：内容变化的卡片，以及 Rating 变化时的头部。
+        每个区域从模板底图裁出，按完整绘制的顺序重放与它相交的所有图层，结果与完整绘制一致
+        """
+        slotKeys = [self._slotKey(section, chartInfo) for section, _, chartInfo in self.slots]
+        dirty = [
+            self._slotBox(section, num)
+            for (section, num, _), key, old in zip(self.slots, slotKeys, previous["slots"])
+            if key != old
+        ]
+        headerOps = None
+        if self.header != previous["header"]:
+            headerOps = self._headerOps()
+            dirty.append(_union([previous["header_box"], self.headerBox]))
         else:
-            self.img.paste(dxImg, (890, 65), mask=dxImg.split()[3])
-            sdImg = Image.open(self.pic_dir / "UI_RSL_MBase_Parts_02.png").convert("RGBA")
-            self.img.paste(sdImg, (758, 65), mask=sdImg.split()[3])
+            self.headerBox = previous["header_box"]
+        for box in dirty:
+            if headerOps is None and _intersects(box, self.headerBox):
+                headerOps = self._headerOps()
+            self._recompose(box, headerOps)
+        self.changed = len(dirty)
+
+    def _recompose(self, box: Tuple[int, int, int, int], headerOps):
+        scratch = self.base.crop(box)
+        ops = list(headerOps) if headerOps and _intersects(box, self.headerBox) else []
+        for section, num, chartInfo in self.slots:
+            if _intersects(box, self._slotBox(section, num)):
+                ops.extend(self._slotOps(section, num, chartInfo))
+        ops.extend((part, pos, True) for part, pos in self.overlay if _intersects(box, _opBox((part, pos, True))))
+        for op in ops:
+            self._apply(scratch, op, box[0], box[1])
+        self.img.paste(scratch, box[:2])
+
+    def state(self) -> Dict[str, Any]:
+        """供下一次增量绘制使用的画布和各卡片指纹"""
+        if self.headerBox is None:
+            self._headerOps()
+        return {
+            "version": TEMPLATE_VERSION,
+            "layout": self.layout.name,
+            "mode": self.img.mode,
+            "size": self.img.size,
+            "canvas": self.img.tobytes(),
+            "header": self.header,
+            "header_box": self.headerBox,
+            "slots": [self._slotKey(section, chartInfo) for section, _, chartInfo in self.slots],
+        }
 
     def getDir(self):
         return self.img
 
 
-def computeRa(ds: float, achievement: float, is_b50: bool = False) -> int:
-    if is_b50:
-        baseRa = 22.4
-        if achievement < 50: baseRa = 7.0
-        elif achievement < 60: baseRa = 8.0
-        elif achievement < 70: baseRa = 9.6
-        elif achievement < 75: baseRa = 11.2
-        elif achievement < 80: baseRa = 12.0
-        elif achievement < 90: baseRa = 13.6
-        elif achievement < 94: baseRa = 15.2
-        elif achievement < 97: baseRa = 16.8
-        elif achievement < 98: baseRa = 20.0
-        elif achievement < 99: baseRa = 20.3
-        elif achievement < 99.5: baseRa = 20.8
-        elif achievement < 100: baseRa = 21.1
-        elif achievement < 100.5: baseRa = 21.6
-    else:
-        baseRa = 15.0
-        if achievement >= 50 and achievement < 60: baseRa = 5.0
-        elif achievement < 70: baseRa = 6.0
-        elif achievement < 75: baseRa = 7.0
-        elif achievement < 80: baseRa = 7.5
-        elif achievement < 90: baseRa = 8.0
-        elif achievement < 94: baseRa = 9.0
-        elif achievement < 97: baseRa = 9.4
-        elif achievement < 98: baseRa = 10.0
-        elif achievement < 99: baseRa = 11.0
-        elif achievement < 99.5: baseRa = 12.0
-        elif achievement < 99.99: baseRa = 13.0
-        elif achievement < 100: baseRa = 13.5
-        elif achievement < 100.5: baseRa = 14.0
+# 达成率区间下界和对应的系数，达成率 < thresholds[0] 时取 factors[0]
+# b40 的 50% 以下沿用旧实现的 6.0
+RA_TABLES = {
+    True: (
+        (50, 60, 70, 75, 80, 90, 94, 97, 98, 99, 99.5, 100, 100.5),
+        (7.0, 8.0, 9.6, 11.2, 12.0, 13.6, 15.2, 16.8, 20.0, 20.3, 20.8, 21.1, 21.6, 22.4),
+    ),
+    False: (
+        (50, 60, 70, 75, 80, 90, 94, 97, 98, 99, 99.5, 99.99, 100, 100.5),
+        (6.0, 5.0, 6.0, 7.0, 7.5, 8.0, 9.0, 9.4, 10.0, 11.0, 12.0, 13.0, 13.5, 14.0, 15.0),
+    ),
+}
+_RA_ARRAYS = {
+    is_b50: (np.array(thresholds, dtype=np.float64), np.array(factors, dtype=np.float64))
+    for is_b50, (thresholds, factors) in RA_TABLES.items()
+}
 
+
+def computeRa(ds: float, achievement: float, is_b50: bool = False) -> int:
+    thresholds, factors = RA_TABLES[is_b50]
+    baseRa = factors[bisect_right(thresholds, achievement)]
     return math.floor(ds * (min(100.5, achievement) / 100) * baseRa)
 
 
-async def generate(payload: Dict, is_b50: bool = False) -> Tuple[Optional[Image.Image], int, Optional[str]]:
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            "https://www.diving-fish.com/api/maimaidxprober/query/player",
-            json=payload,
-        )
-        if resp.status_code == 400: return None, 400, None
-        if resp.status_code == 403: return None, 403, None
-        
-        obj = resp.json()
-        if is_b50:
-            sd_best = BestList(35)
-            dx_best = BestList(15)
-        else:
-            sd_best = BestList(25)
-            dx_best = BestList(15)
+def computeRaBatch(ds: Any, achievement: Any, is_b50: bool = False) -> np.ndarray:
+    """
+    批量计算单曲Rating，ds 与 achievement 为等长数组，结果与逐个调用 computeRa 相同
+    """
+    thresholds, factors = _RA_ARRAYS[is_b50]
+    ds = np.asarray(ds, dtype=np.float64)
+    achievement = np.asarray(achievement, dtype=np.float64)
+    baseRa = factors[np.searchsorted(thresholds, achievement, side="right")]
+    return np.floor(ds * (np.minimum(100.5, achievement) / 100) * baseRa).astype(np.int64)
+
 
-        dx: List[Dict] = obj["charts"]["dx"]
-        sd: List[Dict] = obj["charts"]["sd"]
-        for c in sd:
-            sd_best.push(await ChartInfo.from_json(c))
-        for c in dx:
-            dx_best.push(await ChartInfo.from_json(c))
+def assign_ratings(charts: List[ChartInfo], is_b50: bool = False):
+    """
+    为每个谱面计算一次Rating并记录在 chart.rating 上。b50 按新版公式计算，b40 沿用水鱼返回的 ra
+    """
+    if not charts:
+        return
+    if not is_b50:
+        for chart in charts:
+            chart.rating = chart.ra
+        return
+    ratings = computeRaBatch([c.ds for c in charts], [c.achievement for c in charts], is_b50)
+    for chart, rating in zip(charts, ratings.tolist()):
+        chart.rating = rating
+
+
+def make_render_job(
+    sdBest: BestList,
+    dxBest: BestList,
+    userName: str,
+    playerRating: int,
+    musicRating: int,
+    is_b50: bool = False,
+) -> Dict[str, Any]:
+    """
+    将DrawBest所需的参数打包为纯数据，便于提交到渲染进程
+    """
+    return {
+        "sd": [chart.to_dict() for chart in sdBest],
+        "dx": [chart.to_dict() for chart in dxBest],
+        "sd_size": sdBest.size,
+        "dx_size": dxBest.size,
+        "userName": userName,
+        "playerRating": playerRating,
+        "musicRating": musicRating,
+        "is_b50": is_b50,
+        "encoding": image_encoder.options,
+    }
+
+
+def preload_assets():
+    """载入DrawBest用到的全部UI素材和字体"""
+    for digit in range(10):
+        assets.sprite(f"UI_NUM_Drating_{digit}.png", 0.6)
+    for rank in RANK_PICS:
+        assets.sprite(f"UI_GAM_Rank_{rank}.png", 0.3)
+    for fc in COMBO_PICS[1:]:
+        assets.sprite(f"UI_MSS_MBase_Icon_{fc}_S.png", 0.45)
+    for num in range(1, 11):
+        assets.sprite(f"UI_CMN_DXRating_S_{num:02d}.png")
+    for size in (12, 14, 16, 18):
+        assets.font(TITLE_FONT, size)
+    for layout in LAYOUTS.values():
+        get_template(layout)
+
+
+def render_job_key(job: Dict[str, Any]) -> str:
+    """
+    渲染任务的图片缓存键。包含每张卡片实际使用的封面，
+    新封面同步之前用占位封面绘制的图片在封面到位后不会再被命中
+    """
+    covers = [tile_cache.resolve(get_cover_len5_id(chart["idNum"])) for chart in job["sd"] + job["dx"]]
+    return fingerprint("local", TEMPLATE_VERSION, job, covers)
+
+
+def _job_drawer(job: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> DrawBest:
+    sd_best = BestList.from_records([ChartInfo.from_dict(c) for c in job["sd"]], job["sd_size"])
+    dx_best = BestList.from_records([ChartInfo.from_dict(c) for c in job["dx"]], job["dx_size"])
+    return DrawBest(
+        sd_best,
+        dx_best,
+        job["userName"],
+        job["playerRating"],
+        job["musicRating"],
+        is_b50=job["is_b50"],
+        previous=previous,
+    )
+
+
+def _encode(img: Image.Image, options: Optional[Dict[str, Any]]) -> Tuple[bytes, float]:
+    started = time.perf_counter()
+    try:
+        return encode_image(img, options), time.perf_counter() - started
+    finally:
+        img.close()
 
+
+def render_job(job: Dict[str, Any]) -> Tuple[bytes, float]:
+    """
+    根据渲染任务绘制B40/B50图片，在渲染进程中执行，返回 (图片数据, 编码耗时)
+    """
+    return _encode(_job_drawer(job).getDir(), job.get("encoding"))
+
+
+def render_job_incremental(job: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> Tuple[bytes, float, Dict[str, Any], int]:
+    """
+    在同一玩家上一次的画布上只重绘变化的卡片，返回 (图片数据, 编码耗时, 新的画布状态, 重绘的区域数)。
+    previous 为空或与当前布局不符时完整绘制
+    """
+    drawer = _job_drawer(job, previous)
+    state = drawer.state()
+    data, encode_time = _encode(drawer.getDir(), job.get("encoding"))
+    return data, encode_time, state, drawer.changed
+
+
+async def prepare_scores(
+    payload: Dict, is_b50: bool = False, force: bool = False
+) -> Tuple[int, Optional[BestList], Optional[BestList], Optional[str], Optional[Dict[str, Any]]]:
+    """
+    查询并解析成绩，返回 (状态, SD最佳, DX最佳, 成绩文本, 渲染任务)，状态为0表示成功。
+    OneShot和本地渲染共用同一次查询，成绩文本可以在出图之前交给AI锐评
+    """
+    with metrics.stage("query"):
+        status, obj = await query_player(payload, force)
+    if status != 200:
+        return status, None, None, None, None
+
+    with metrics.stage("parse"):
+        sd_best, dx_best = await parse_best_lists(obj, is_b50)
         nickname = obj["nickname"]
-        
+        text_result = build_score_text(obj, sd_best, dx_best, is_b50)
+
         if is_b50:
-            sd_rating = sum(computeRa(c.ds, c.achievement, is_b50) for c in sd_best)
-            dx_rating = sum(computeRa(c.ds, c.achievement, is_b50) for c in dx_best)
-            total_rating = sd_rating + dx_rating
-            text_result = f"玩家: {nickname}\n"
-            text_result += f"Rating: {total_rating} (SD: {sd_rating} + DX: {dx_rating})\n\n"
-            text_result += "--- SD Best (B35) ---\n"
-            for i, chart in enumerate(sd_best):
-                text_result += f"#{i+1}: {chart.title} [{diffs[chart.diff]}] | DS: {chart.ds:.1f}, Ach: {chart.achievement:.4f}%, RA: {computeRa(chart.ds, chart.achievement, is_b50)}\n"
-            
-            text_result += "\n--- DX Best (B15) ---\n"
-            for i, chart in enumerate(dx_best):
-                text_result += f"#{i+1}: {chart.title} [{diffs[chart.diff]}] | DS: {chart.ds:.1f}, Ach: {chart.achievement:.4f}%, RA: {computeRa(chart.ds, chart.achievement, is_b50)}\n"
-
-            pic = DrawBest(sd_best, dx_best, nickname, total_rating, 0, is_b50=True).getDir()
-            
-            return pic, 0, text_result
+            total_rating = sum(c.rating for c in sd_best) + sum(c.rating for c in dx_best)
+            job = make_render_job(sd_best, dx_best, nickname, total_rating, 0, is_b50=True)
         else:
             rating = obj["rating"]
-            additional_rating = obj["additional_rating"]
-            total_rating = rating + additional_rating
-            text_result = f"玩家: {nickname}\n"
-            text_result += f"Rating: {total_rating} (底分: {rating} + 段位分: {additional_rating})\n\n"
-            text_result += "--- SD Best (B25) ---\n"
-            for i, chart in enumerate(sd_best):
-                text_result += f"#{i+1}: {chart.title} [{diffs[chart.diff]}] | DS: {chart.ds:.1f}, Ach: {chart.achievement:.4f}%, RA: {chart.ra}\n"
-            
-            text_result += "\n--- DX Best (B15) ---\n"
-            for i, chart in enumerate(dx_best):
-                text_result += f"#{i+1}: {chart.title} [{diffs[chart.diff]}] | DS: {chart.ds:.1f}, Ach: {chart.achievement:.4f}%, RA: {chart.ra}\n"
-
-            pic = DrawBest(sd_best, dx_best, nickname, total_rating, rating, is_b50=False).getDir()
-            
-            return pic, 0, text_result
\ No newline at end of file
+            total_rating = rating + obj["additional_rating"]
+            job = make_render_job(sd_best, dx_best, nickname, total_rating, rating, is_b50=False)
+
+    return 0, sd_best, dx_best, text_result, job
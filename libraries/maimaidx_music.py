@@ -1,75 +1,173 @@
+import asyncio
+import json
+import os
 import random
+import time
 import unicodedata
-from copy import deepcopy
 from typing import Any, ClassVar, Dict, List, Optional, Tuple, Union
-import httpx
-
-class Chart(Dict):
-    tap: Optional[int] = None
-    slide: Optional[int] = None
-    hold: Optional[int] = None
-    touch: Optional[int] = None
-    brk: Optional[int] = None
-    charter: Optional[int] = None
-
-    def __getattribute__(self, item):
-        if item == "tap":
-            return self["notes"][0]
-        if item == "hold":
-            return self["notes"][1]
-        if item == "slide":
-            return self["notes"][2]
-        if item == "touch":
-            return self["notes"][3] if len(self["notes"]) == 5 else 0
-        if item == "brk":
-            return self["notes"][-1]
-        if item == "charter":
-            return self["charter"]
-        return super().__getattribute__(item)
-
-class Music(Dict):
-    id: Optional[str] = None
-    title: Optional[str] = None
-    ds: Optional[List[float]] = None
-    level: Optional[List[str]] = None
-    genre: Optional[str] = None
-    type: Optional[str] = None
-    bpm: Optional[float] = None
-    version: Optional[str] = None
-    charts: Optional[Chart] = None
-    release_date: Optional[str] = None
-    artist: Optional[str] = None
-
-    diff: ClassVar[List[int]] = []
-
-    def __getattribute__(self, item):
-        if item in {"genre", "artist", "release_date", "bpm", "version"}:
-            if item == "version":
-                return self["basic_info"]["from"]
-            return self["basic_info"][item]
-        if item in self:
-            return self[item]
-        return super().__getattribute__(item)
+from astrbot.api import logger
+from .catalogue import ChartCatalogue, ChartView
+from .http_client import DIVING_FISH, http
+from .path_config import STATIC
+
+class _Record(object):
+    """
+    只读的槽位记录，构建后不可修改。
+
+    保留旧版 Dict 子类的访问方式：record["key"]、record.get("key") 和 "key" in record
+    """
+
+    __slots__ = ()
+    _aliases: ClassVar[Dict[str, str]] = {}
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, self._aliases.get(key, key))
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__ if name != "charts")
+        return f"{type(self).__name__}({fields})"
+
+
+class Chart(_Record):
+    __slots__ = ("notes", "charter", "tap", "hold", "slide", "touch", "brk")
+
+    def __init__(self, notes: List[int], charter: Optional[str] = None):
+        notes = tuple(notes)
+        init = object.__setattr__
+        init(self, "notes", notes)
+        init(self, "charter", charter)
+        init(self, "tap", notes[0])
+        init(self, "hold", notes[1])
+        init(self, "slide", notes[2])
+        init(self, "touch", notes[3] if len(notes) == 5 else 0)
+        init(self, "brk", notes[-1])
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Chart":
+        return cls(data["notes"], data.get("charter"))
+
+
+class Music(_Record):
+    __slots__ = (
+        "id", "title", "type", "ds", "level", "cids", "charts",
+        "genre", "artist", "release_date", "bpm", "version", "is_new",
+    )
+    _aliases: ClassVar[Dict[str, str]] = {"from": "version"}
+
+    def __init__(self, **fields: Any):
+        init = object.__setattr__
+        for name in self.__slots__:
+            init(self, name, fields.get(name))
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Music":
+        """从水鱼 music_data 的单条记录构建，曲目加载时调用一次"""
+        info = data.get("basic_info") or {}
+        charts = data.get("charts")
+        return cls(
+            id=str(data["id"]),
+            title=data.get("title"),
+            type=data.get("type"),
+            ds=tuple(data.get("ds") or ()),
+            level=tuple(data.get("level") or ()),
+            cids=tuple(data.get("cids") or ()),
+            charts=tuple(Chart.from_dict(c) for c in charts) if charts is not None else None,
+            genre=info.get("genre"),
+            artist=info.get("artist"),
+            release_date=info.get("release_date"),
+            bpm=info.get("bpm"),
+            version=info.get("from"),
+            is_new=info.get("is_new"),
+        )
+
+    @property
+    def basic_info(self) -> Dict[str, Any]:
+        """兼容旧的 music["basic_info"] 访问"""
+        return {
+            "title": self.title,
+            "artist": self.artist,
+            "genre": self.genre,
+            "bpm": self.bpm,
+            "release_date": self.release_date,
+            "from": self.version,
+            "is_new": self.is_new,
+        }
 
 class MusicList(List[Music]):
-    async def by_id(self, music_id: str) -> Optional[Music]:
-        await ensure_initialized()
-        for music in self:
-            if music.id == music_id:
-                return music
-        return None
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._index: Tuple[Dict[str, Music], Dict[str, Music], Dict[Tuple[str, str], Music]] = ({}, {}, {})
+        self._catalogue: Optional[ChartCatalogue] = None
+        if self:
+            self.rebuild_index()
 
-    async def by_title(self, music_title: str) -> Optional[Music]:
-        await ensure_initialized()
+    def rebuild_index(self):
+        """重建 id、标题 和 (标题, 类型) 索引，同名时与线性查找一样取列表中的第一首"""
+        by_id: Dict[str, Music] = {}
+        by_title: Dict[str, Music] = {}
+        by_title_type: Dict[Tuple[str, str], Music] = {}
         for music in self:
-            normalized_api_title = unicodedata.normalize('NFKC', music_title)
-            normalized_db_title = unicodedata.normalize('NFKC', music.basic_info['title'])
-            if normalized_db_title == normalized_api_title:
+            title = unicodedata.normalize('NFKC', music.title)
+            by_id.setdefault(music.id, music)
+            by_title.setdefault(title, music)
+            by_title_type.setdefault((title, music.type), music)
+        self._index = (by_id, by_title, by_title_type)
+        self._catalogue = None
+
+    @property
+    def catalogue(self) -> ChartCatalogue:
+        """谱面列式目录，在首次查询时按当前列表构建，列表替换后失效"""
+        if self._catalogue is None:
+            self._catalogue = ChartCatalogue(list(self))
+        return self._catalogue
+
+    def replace(self, musics: List[Music]):
+        """整体替换曲目列表并重建索引，期间不会让出事件循环"""
+        self[:] = musics
+        self.rebuild_index()
+
+    def find_by_id(self, music_id: str) -> Optional[Music]:
+        return self._index[0].get(str(music_id))
+
+    def find_by_title(self, music_title: str, music_type: Optional[str] = None) -> Optional[Music]:
+        normalized_title = unicodedata.normalize('NFKC', music_title)
+        if music_type:
+            music = self._index[2].get((normalized_title, music_type))
+            if music is not None:
                 return music
-        return None
+        return self._index[1].get(normalized_title)
+
+    async def by_id(self, music_id: str) -> Optional[Music]:
+        if not _initialized:
+            await ensure_initialized()
+        return self.find_by_id(music_id)
+
+    async def by_title(self, music_title: str, music_type: Optional[str] = None) -> Optional[Music]:
+        if not _initialized:
+            await ensure_initialized()
+        return self.find_by_title(music_title, music_type)
 
     async def random(self):
-        await ensure_initialized()
+        if not _initialized:
+            await ensure_initialized()
         return random.choice(self)
 
     async def filter(
@@ -81,65 +179,131 @@ class MusicList(List[Music]):
         genre: Optional[Union[str, List[str]]] = ...,
         bpm: Optional[Union[float, List[float], Tuple[float, float]]] = ...,
         type_: Optional[Union[str, List[str]]] = ...,
+        version: Optional[Union[str, List[str]]] = ...,
         diff: List[int] = ...,
-    ):
-        new_list = MusicList()
-        for music in self:
-            diff2 = diff
-            music = deepcopy(music)
-            if not music.level:
-                continue
-            if not music.ds:
-                continue
-            if not title_search:
-                continue
-            if not music.title:
-                continue
-            ret, diff2 = cross(music.level, level, diff2)
-            if not ret:
-                continue
-            ret, diff2 = cross(music.ds, ds, diff2)
-            if not ret:
-                continue
-            if not in_or_equal(music.genre, genre):
-                continue
-            if not in_or_equal(music.type, type_):
-                continue
-            if not in_or_equal(music.bpm, bpm):
-                continue
-            if (
-                title_search is not Ellipsis
-                and title_search.lower() not in music.title.lower()
-            ):
-                continue
-            music.diff = diff2
-            new_list.append(music)
-        return new_list
+    ) -> ChartView:
+        """
+        按谱面筛选，条件与 in_or_equal 一致：列表表示包含，元组表示闭区间，其他表示相等。
+        返回只引用原曲目的 ChartView，可用 musics() 按曲目分组
+        """
+        if self is total_list and not _initialized:
+            await ensure_initialized()
+        return self.catalogue.query(
+            level=level,
+            ds=ds,
+            title_search=title_search,
+            genre=genre,
+            bpm=bpm,
+            type_=type_,
+            version=version,
+            diff=diff,
+        )
 
-obj = None
 total_list = MusicList()
 _initialized = False
+_init_task: Optional[asyncio.Task] = None
 
-async def ensure_initialized():
+def is_music_ready() -> bool:
+    """曲目数据是否已经加载完成，可在指令中直接判断而无需等待"""
+    return _initialized
+
+async def _initialize_once():
     global _initialized
-    if not _initialized:
-        await initialize_music_data()
-        _initialized = True
+    await initialize_music_data()
+    _initialized = True
+
+async def ensure_initialized():
+    """
+    确保曲目数据已加载。并发调用只会触发一次加载，所有调用方等待同一个任务；
+    加载失败后下一次调用会重新尝试
+    """
+    global _init_task
+    if _initialized:
+        return
+    if _init_task is None or (_init_task.done() and not _initialized):
+        _init_task = asyncio.ensure_future(_initialize_once())
+    await asyncio.shield(_init_task)
+
+# 本地曲目数据快照，格式变化时递增版本号，旧快照会被忽略
+SNAPSHOT_VERSION = 1
+SNAPSHOT_PATH = STATIC / "music_data.json"
+MUSIC_DATA_URL = f"{DIVING_FISH}/api/maimaidxprober/music_data"
+_snapshot_meta: Dict[str, Optional[str]] = {"etag": None, "last_modified": None}
+_refresh_task: Optional[asyncio.Task] = None
+
+def _build_musics(data: List[Dict]) -> List[Music]:
+    return [Music.from_dict(m) for m in data]
+
+def _load_snapshot() -> Optional[Dict]:
+    try:
+        with SNAPSHOT_PATH.open("r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get("version") != SNAPSHOT_VERSION or not snapshot.get("data"):
+        return None
+    return snapshot
+
+def _write_snapshot(data: List[Dict], etag: Optional[str], last_modified: Optional[str]):
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "etag": etag,
+        "last_modified": last_modified,
+        "fetched_at": int(time.time()),
+        "data": data,
+    }
+    tmp_path = SNAPSHOT_PATH.with_name(f".{SNAPSHOT_PATH.name}.{os.getpid()}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, SNAPSHOT_PATH)
+
+async def refresh_music_data() -> bool:
+    """
+    向水鱼条件请求曲目数据，有更新时替换 total_list 并写入快照。返回数据是否发生变化
+    """
+    headers = {}
+    if _snapshot_meta["etag"]:
+        headers["If-None-Match"] = _snapshot_meta["etag"]
+    if _snapshot_meta["last_modified"]:
+        headers["If-Modified-Since"] = _snapshot_meta["last_modified"]
+    response = await http.get(MUSIC_DATA_URL, endpoint="music_data", headers=headers)
+    if response.status_code == 304:
+        logger.info("曲目数据未变化")
+        return False
+    response.raise_for_status()
+    data = response.json()
+    total_list.replace(_build_musics(data))
+    _snapshot_meta["etag"] = response.headers.get("ETag")
+    _snapshot_meta["last_modified"] = response.headers.get("Last-Modified")
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, _write_snapshot, data, _snapshot_meta["etag"], _snapshot_meta["last_modified"])
+    except OSError as e:
+        logger.warning(f"写入曲目数据快照失败: {e}")
+    logger.info(f"曲目数据已更新，共 {len(total_list)} 首")
+    return True
+
+async def _refresh_music_data_background():
+    try:
+        await refresh_music_data()
+    except Exception as e:
+        logger.warning(f"后台更新曲目数据失败，继续使用本地快照: {e}")
 
 async def initialize_music_data():
-    global obj, total_list
-
-    async def fetch_json(url):
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-            return response.json()
-
-    obj = await fetch_json("https://www.diving-fish.com/api/maimaidxprober/music_data")
-    total_list.extend(Music(m) for m in obj)
-    for music in total_list:
-        if music.charts is None:
-            continue
-        music.charts = [Chart(c) for c in music.charts]
+    """
+    优先从本地快照加载曲目数据并在后台校验更新；没有可用快照时直接从水鱼下载
+    """
+    global _refresh_task
+    loop = asyncio.get_running_loop()
+    snapshot = await loop.run_in_executor(None, _load_snapshot)
+    if snapshot is None:
+        await refresh_music_data()
+        return
+    total_list.replace(_build_musics(snapshot["data"]))
+    _snapshot_meta["etag"] = snapshot.get("etag")
+    _snapshot_meta["last_modified"] = snapshot.get("last_modified")
+    logger.info(f"已从本地快照加载曲目数据，共 {len(total_list)} 首")
+    _refresh_task = asyncio.create_task(_refresh_music_data_background())
 
 def get_cover_len5_id(mid) -> str:
     mid = int(mid)
@@ -0,0 +1,174 @@
+import os
+import time
+from bisect import bisect_left
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple, Type, Union
+
+# 直方图桶的上界（秒）
+BUCKETS: Tuple[float, ...] = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+
+# 大小直方图桶的上界（字节）
+SIZE_BUCKETS: Tuple[float, ...] = tuple(kb * 1024 for kb in (32, 64, 128, 256, 512, 1024, 2048, 4096))
+
+# 汇总和导出的滚动分位数
+QUANTILES: Tuple[float, ...] = (0.5, 0.95, 0.99)
+
+
+class LatencyHistogram(object):
+    """
+    延迟直方图。
+
+    累计各桶的计数、总数和总和，同时保留最近 window 个样本，用于计算滚动分位数。
+    """
+
+    buckets: Tuple[float, ...] = BUCKETS
+    unit = "seconds"
+
+    def __init__(self, name: str, window: int = 200):
+        self.name = name
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._recent: Deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self._recent.append(seconds)
+
+    def quantile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        """最近样本的分位数，样本不足 min_samples 时返回 None"""
+        if len(self._recent) < max(1, min_samples):
+            return None
+        samples = sorted(self._recent)
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def _format(self, value: float) -> str:
+        return f"{value:.2f}s"
+
+    def summary(self) -> str:
+        if not self.count:
+            return f"{self.name}: 无数据"
+        quantiles = " ".join(f"p{q * 100:g} {self._format(self.quantile(q))}" for q in QUANTILES)
+        return f"{self.name}: {self.count}次 平均{self._format(self.sum / self.count)} {quantiles}"
+
+    def prometheus(self, prefix: str) -> List[str]:
+        """Prometheus 文本格式：累计的桶计数、总和与总数，以及最近样本的分位数"""
+        name = f"{prefix}_{self.name}_{self.unit}"
+        lines = [f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound:.10g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum {self.sum:.6f}")
+        lines.append(f"{name}_count {self.count}")
+        if self._recent:
+            lines.append(f"# TYPE {name}_recent gauge")
+            lines.extend(f'{name}_recent{{quantile="{q:g}"}} {self.quantile(q):.6f}' for q in QUANTILES)
+        return lines
+
+
+class SizeHistogram(LatencyHistogram):
+    """大小直方图，单位为字节"""
+
+    buckets = SIZE_BUCKETS
+    unit = "bytes"
+
+    def _format(self, value: float) -> str:
+        return f"{value / 1024:.0f}KB"
+
+
+class Timer(object):
+    """with 语句计时，退出时写入直方图"""
+
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: LatencyHistogram):
+        self.histogram = histogram
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class _NullTimer(object):
+    """关闭分阶段统计时使用的空计时器"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics(object):
+    """
+    插件内的延迟和大小指标，按名字创建直方图。
+
+    timer() 和 histogram() 始终记录，对冲延迟依赖这些数据；
+    stage() 和 record() 用于查分流程各阶段的统计，enabled 为 False 时直接返回，几乎没有开销。
+    """
+
+    def __init__(self, enabled: bool = True, prefix: str = "maimaidx"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self._histograms: Dict[str, LatencyHistogram] = {}
+
+    def configure(self, enabled: Optional[bool] = None):
+        if enabled is not None:
+            self.enabled = enabled
+
+    def histogram(self, name: str, kind: Type[LatencyHistogram] = LatencyHistogram) -> LatencyHistogram:
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = kind(name)
+            self._histograms[name] = histogram
+        return histogram
+
+    def size(self, name: str) -> LatencyHistogram:
+        return self.histogram(name, SizeHistogram)
+
+    def timer(self, name: str) -> Timer:
+        return Timer(self.histogram(name))
+
+    def stage(self, name: str) -> Union[Timer, _NullTimer]:
+        """查分流程中一个阶段的计时器"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return Timer(self.histogram(name))
+
+    def record(self, name: str, value: float, kind: Type[LatencyHistogram] = LatencyHistogram):
+        """记录一个阶段的耗时或大小"""
+        if self.enabled:
+            self.histogram(name, kind).observe(value)
+
+    def summary(self) -> str:
+        return "\n".join(h.summary() for _, h in sorted(self._histograms.items()))
+
+    def prometheus(self) -> str:
+        lines: List[str] = []
+        for _, histogram in sorted(self._histograms.items()):
+            lines.extend(histogram.prometheus(self.prefix))
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Union[str, Path]):
+        """写入 Prometheus 文本文件，先写临时文件再替换，供 node_exporter 的 textfile 收集器读取"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(self.prometheus(), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
@@ -1,9 +1,18 @@
-from typing import Dict, List, Any, Optional
-from .maimaidx_music import total_list
+import heapq
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from .maimaidx_music import ensure_initialized, is_music_ready, total_list
 
 diffs = ["Basic", "Advanced", "Expert", "Master", "Re:Master"]
 
+rate = ["d", "c", "b", "bb", "bbb", "a", "aa", "aaa", "s", "sp", "ss", "ssp", "sss", "sssp"]
+fc = ["", "fc", "fcp", "ap", "app"]
+RATE_INDEX = {r: i for i, r in enumerate(rate)}
+FC_INDEX = {f: i for i, f in enumerate(fc)}
+
+
 class ChartInfo(object):
+    __slots__ = ("idNum", "diff", "tp", "achievement", "ra", "comboId", "scoreId", "title", "ds", "lv", "rating")
+
     def __init__(
         self,
         idNum: str,
@@ -16,6 +25,7 @@ class ChartInfo(object):
         title: str,
         ds: float,
         lv: str,
+        rating: Optional[int] = None,
     ):
         self.idNum = idNum
         self.diff = diff
@@ -27,6 +37,8 @@ class ChartInfo(object):
         self.title = title
         self.ds = ds
         self.lv = lv
+        # 用于展示和求和的单曲Rating，由 assign_ratings 计算一次
+        self.rating = rating
 
     def __str__(self):
         return (
@@ -41,50 +53,120 @@ class ChartInfo(object):
         return self.ra < other.ra
 
     @classmethod
-    async def from_json(cls, data):
-        rate = [
-            "d", "c", "b", "bb", "bbb", "a", "aa", "aaa", "s", "sp", "ss", "ssp", "sss", "sssp",
-        ]
-        ri = rate.index(data["rate"])
-        fc = ["", "fc", "fcp", "ap", "app"]
-        fi = fc.index(data["fc"])
-        music = await total_list.by_title(data["title"])
+    def from_record(cls, data: Dict[str, Any]) -> "ChartInfo":
+        """
+        从水鱼的单条成绩构建，带 song_id 时直接使用，否则按 (标题, 类型) 查索引。
+        调用前曲目数据需要已经加载
+        """
+        if data.get("song_id") is not None:
+            idNum = str(data["song_id"])
+        else:
+            music = total_list.find_by_title(data["title"], data["type"])
+            idNum = music.id if music else "00000"
         return cls(
-            idNum=music.id if music else "00000",
+            idNum=idNum,
             title=data["title"],
             diff=data["level_index"],
             ra=data["ra"],
             ds=data["ds"],
-            comboId=fi,
-            scoreId=ri,
+            comboId=FC_INDEX[data["fc"]],
+            scoreId=RATE_INDEX[data["rate"]],
             lv=data["level"],
             achievement=data["achievements"],
             tp=data["type"],
         )
 
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]]) -> List["ChartInfo"]:
+        """批量构建，调用前曲目数据需要已经加载"""
+        from_record = cls.from_record
+        return [from_record(data) for data in records]
+
+    @classmethod
+    async def from_json(cls, data):
+        if not is_music_ready():
+            await ensure_initialized()
+        return cls.from_record(data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为可跨进程传递的纯数据"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        return cls(**data)
+
 
 class BestList(object):
+    """
+    按 ra 从高到低保留前 size 条成绩。
+
+    内部是以 (ra, -插入序号) 为键的最小堆，push 为 O(log size)。
+    ra 相同时先加入的排在前面，已满时与最低成绩同分的新成绩不会挤掉旧成绩，
+    与 sorted(records, reverse=True)[:size] 的结果一致。
+    """
+
     def __init__(self, size: int):
-        self.data = []
         self.size = size
+        self._heap: List[Tuple[Any, int, ChartInfo]] = []
+        self._seq = 0
+        self._sorted: Optional[List[ChartInfo]] = []
+
+    @classmethod
+    def from_records(cls, records: Iterable[ChartInfo], size: int) -> "BestList":
+        """一次性从成绩列表构建"""
+        best = cls(size)
+        entries = [(elem.ra, -seq, elem) for seq, elem in enumerate(records)]
+        best._seq = len(entries)
+        best._heap = heapq.nlargest(size, entries, key=lambda e: e[:2])
+        heapq.heapify(best._heap)
+        best._sorted = None
+        return best
+
+    @classmethod
+    def split_from_records(
+        cls,
+        records: Iterable[ChartInfo],
+        is_dx: Callable[[ChartInfo], bool],
+        sd_size: int,
+        dx_size: int,
+    ) -> Tuple["BestList", "BestList"]:
+        """遍历一次成绩，按 is_dx 分别构建旧版本和新版本的最佳成绩列表"""
+        sd_best, dx_best = cls(sd_size), cls(dx_size)
+        for elem in records:
+            (dx_best if is_dx(elem) else sd_best).push(elem)
+        return sd_best, dx_best
 
     def push(self, elem: ChartInfo):
-        if len(self.data) >= self.size and elem < self.data[-1]:
+        entry = (elem.ra, -self._seq, elem)
+        self._seq += 1
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, entry)
+        elif self._heap and entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+        else:
             return
-        self.data.append(elem)
-        self.data.sort()
-        self.data.reverse()
-        while len(self.data) > self.size:
-            del self.data[-1]
+        self._sorted = None
 
     def pop(self):
-        del self.data[-1]
+        """移除最低的一条成绩"""
+        heapq.heappop(self._heap)
+        self._sorted = None
+
+    @property
+    def data(self) -> List[ChartInfo]:
+        if self._sorted is None:
+            self._sorted = [entry[2] for entry in sorted(self._heap, key=lambda e: e[:2], reverse=True)]
+        return self._sorted
 
     def __str__(self):
         return "[\n\t" + ", \n\t".join([str(ci) for ci in self.data]) + "\n]"
 
     def __len__(self):
-        return len(self.data)
+        return len(self._heap)
+
+    def __iter__(self) -> Iterator[ChartInfo]:
+        return iter(self.data)
 
     def __getitem__(self, index):
-        return self.data[index]
\ No newline at end of file
+        return self.data[index]
@@ -0,0 +1,122 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from astrbot.api import logger
+
+from .assets import assets
+from .image_generator import preload_assets, render_job, render_job_incremental
+from .tile_cache import tile_cache
+
+
+class RenderBusyError(Exception):
+    """渲染队列已满时抛出"""
+
+
+def _warm_worker(options: Dict[str, Any]):
+    """渲染进程初始化：应用配置，载入UI素材和字体，再绘制一张空白B50预热PIL"""
+    tile_cache.configure(**options.get("tile_cache", {}))
+    try:
+        preload_assets()
+        render_job({
+            "sd": [],
+            "dx": [],
+            "sd_size": 35,
+            "dx_size": 15,
+            "userName": "",
+            "playerRating": 0,
+            "musicRating": 0,
+            "is_b50": True,
+        })
+        logger.info(f"渲染进程 {os.getpid()} 预热完成，素材缓存: {assets.memory_footprint()}")
+    except Exception as e:
+        logger.warning(f"渲染进程 {os.getpid()} 预热失败: {e}")
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class RenderService(object):
+    """
+    本地B40/B50渲染服务。
+
+    渲染和编码在常驻的进程池中完成，事件循环只负责提交纯数据任务并等待图片数据。
+    正在渲染和排队的任务总数超过 workers + queue_size 时直接抛出 RenderBusyError。
+    workers 为 0 时退化为在默认线程池中渲染。
+    options 会在每个渲染进程启动时应用，例如 {"tile_cache": {"max_items": 512}}。
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 8, options: Optional[Dict[str, Any]] = None):
+        self.workers = max(0, workers)
+        self.queue_size = max(0, queue_size)
+        self.options = options or {}
+        self._pending = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def capacity(self) -> int:
+        return max(1, self.workers) + self.queue_size
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self):
+        if self.workers == 0 or self._pool is not None:
+            return
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_worker,
+            initargs=(self.options,),
+        )
+        # 进程池按需启动进程，这里提前提交任务让所有进程完成预热
+        for _ in range(self.workers):
+            self._pool.submit(_ping)
+        logger.info(f"渲染服务已启动，进程数: {self.workers}，队列长度: {self.queue_size}")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def restart(self):
+        """重建进程池，例如资源文件更新后。新任务提交到新进程池，旧进程池中已提交的任务照常完成"""
+        old_pool, self._pool = self._pool, None
+        self.start()
+        if old_pool is not None:
+            old_pool.shutdown(wait=False)
+
+    async def _submit(self, fn: Callable, *args):
+        if self._pending >= self.capacity:
+            raise RenderBusyError(f"渲染队列已满 ({self._pending}/{self.capacity})")
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._pool, fn, *args)
+        # 已提交的任务无法从进程中取消，名额一直占用到任务真正结束，调用方被取消时也不提前释放
+        self._pending += 1
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.shield(future)
+        except BrokenProcessPool:
+            logger.error("渲染进程异常退出，正在重建进程池")
+            self.restart()
+            raise
+
+    def _release(self, future: asyncio.Future):
+        self._pending -= 1
+        if not future.cancelled():
+            # 调用方已被取消时没有人读取结果，这里取出异常以免产生未处理异常的警告
+            future.exception()
+
+    async def render(self, job: Dict[str, Any]) -> Tuple[bytes, float]:
+        """返回 (图片数据, 编码耗时)"""
+        return await self._submit(render_job, job)
+
+    async def render_incremental(self, job: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> Tuple[bytes, float, Dict[str, Any], int]:
+        """以同一玩家上一次的画布为底只重绘变化的卡片，返回 (图片数据, 编码耗时, 新的画布状态, 重绘的区域数)"""
+        return await self._submit(render_job_incremental, job, previous)
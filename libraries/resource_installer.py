@@ -0,0 +1,235 @@
+import asyncio
+import json
+import os
+import shutil
+import time
+import uuid
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiofiles
+import httpx
+from astrbot.api import logger
+
+from .http_client import DIVING_FISH, http
+from .path_config import STATIC
+
+STATIC_URL = f"{DIVING_FISH}/maibot/static.zip"
+# 清单格式变化时递增，旧清单会被忽略
+MANIFEST_VERSION = 1
+
+Progress = Callable[[str], Awaitable[None]]
+
+
+async def _report(progress: Optional[Progress], msg: str):
+    logger.info(msg)
+    if progress is not None:
+        try:
+            await progress(msg)
+        except Exception as e:
+            logger.warning(f"发送资源安装进度失败: {e}")
+
+
+def _crc32(path: Path) -> int:
+    crc = 0
+    with path.open("rb") as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                return crc
+            crc = zlib.crc32(block, crc)
+
+
+def _merge_missing(old: Path, new: Path):
+    """把 old 中 new 没有的条目移动到 new 下，用于保留封面缓存、卡片缓存等本地生成的文件"""
+    for entry in old.iterdir():
+        target = new / entry.name
+        if not target.exists():
+            os.replace(entry, target)
+        elif entry.is_dir() and target.is_dir():
+            _merge_missing(entry, target)
+
+
+def _expected_size(response: httpx.Response, offset: int) -> int:
+    """
+    资源包的完整大小，未知时为 0。206 响应按 Content-Range 中的总大小计算，
+    分块传输的响应可能没有 Content-Length
+    """
+    if response.status_code == 206:
+        content_range = response.headers.get("Content-Range", "")
+        total = content_range.rpartition("/")[2]
+        return int(total) if total.isdigit() else 0
+    length = response.headers.get("Content-Length", "")
+    return offset + int(length) if length.isdigit() else 0
+
+
+class ResourceInstaller(object):
+    """
+    mai 静态资源安装器。
+
+    static.zip 下载到 STATIC 下的 .part 文件，中断后用 Range 请求续传（If-Range 保证远端文件未变）；
+    下载完成后校验压缩包的 CRC，在线程中解压到临时目录，再整体替换 STATIC 下的同名条目。
+    原目录中压缩包里没有的文件（封面同步下载的封面、卡片缓存等）会被保留。
+    每个文件的大小和 CRC32 直接取自压缩包目录，写入 mai/.resource_manifest.json，供 verify() 校验。
+    """
+
+    def __init__(self, url: str, target_dir: Path, workers: int = 4):
+        self.url = url
+        self.target_dir = target_dir
+        self.part_path = target_dir / "static.zip.part"
+        self.manifest_path = target_dir / "mai" / ".resource_manifest.json"
+        self.workers = workers
+        self._lock = asyncio.Lock()
+
+    @property
+    def installed(self) -> bool:
+        return (self.target_dir / "mai" / "pic").exists()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def install(self, progress: Optional[Progress] = None) -> str:
+        async with self._lock:
+            await _report(progress, "正在下载mai资源，资源包大小预计90M")
+            await self._download(progress)
+            await _report(progress, "下载完成，正在校验并解压mai资源")
+            loop = asyncio.get_running_loop()
+            count = await loop.run_in_executor(None, self._install_archive)
+            self.part_path.unlink(missing_ok=True)
+            Path(f"{self.part_path}.json").unlink(missing_ok=True)
+            return f"mai资源下载成功，共 {count} 个文件，请使用【mai帮助】获取指令"
+
+    async def _download(self, progress: Optional[Progress]):
+        meta_path = Path(f"{self.part_path}.json")
+        offset = self.part_path.stat().st_size if self.part_path.exists() else 0
+        validator = None
+        if offset:
+            try:
+                validator = json.loads(meta_path.read_text(encoding="utf-8")).get("validator")
+            except (OSError, ValueError):
+                validator = None
+            if validator is None:
+                offset = 0
+        headers = {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+
+        async with http.stream("GET", self.url, endpoint="static", headers=headers) as response:
+            if response.status_code == 416 and offset:
+                # 已经下载完整
+                return
+            response.raise_for_status()
+            if response.status_code != 206:
+                offset = 0
+            else:
+                logger.info(f"从 {offset / 1024 / 1024:.1f}MB 处继续下载mai资源")
+            total = _expected_size(response, offset)
+            validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+            meta_path.write_text(json.dumps({"validator": validator}), encoding="utf-8")
+
+            downloaded = offset
+            started = last_report = time.monotonic()
+            next_percent = 25
+            async with aiofiles.open(self.part_path, "ab" if offset else "wb") as f:
+                async for chunk in response.aiter_bytes():
+                    await f.write(chunk)
+                    downloaded += len(chunk)
+                    now = time.monotonic()
+                    if total and now - last_report >= 1:
+                        percent = downloaded / total * 100
+                        logger.info(f"下载进度: {percent:.2f}%，{(downloaded - offset) / 1024 / (now - started):.0f}KB/s")
+                        last_report = now
+                        if percent >= next_percent:
+                            await _report(progress, f"mai资源下载进度: {percent:.0f}%")
+                            next_percent = (int(percent) // 25 + 1) * 25
+        if total and downloaded != total:
+            raise IOError(f"资源包不完整: {downloaded}/{total}")
+
+    def _install_archive(self) -> int:
+        try:
+            with zipfile.ZipFile(self.part_path, "r") as zip_file:
+                bad = zip_file.testzip()
+                if bad is not None:
+                    raise zipfile.BadZipFile(f"压缩包中的 {bad} 校验失败")
+                staging = self.target_dir / f".staging-{uuid.uuid4().hex}"
+                try:
+                    zip_file.extractall(staging)
+                    manifest = {
+                        info.filename[len("mai/"):]: {"size": info.file_size, "crc": info.CRC}
+                        for info in zip_file.infolist()
+                        if info.filename.startswith("mai/") and not info.is_dir()
+                    }
+                    if manifest:
+                        with (staging / "mai" / self.manifest_path.name).open("w", encoding="utf-8") as f:
+                            json.dump({"version": MANIFEST_VERSION, "files": manifest}, f, ensure_ascii=False)
+                    self._swap(staging)
+                finally:
+                    shutil.rmtree(staging, ignore_errors=True)
+                return len(zip_file.infolist())
+        except zipfile.BadZipFile:
+            # 损坏的压缩包无法续传，删掉后下次重新下载
+            self.part_path.unlink(missing_ok=True)
+            raise
+
+    def _swap(self, staging: Path):
+        for entry in staging.iterdir():
+            target = self.target_dir / entry.name
+            if entry.is_dir() and target.is_dir():
+                _merge_missing(target, entry)
+                backup = self.target_dir / f".old-{uuid.uuid4().hex}"
+                os.replace(target, backup)
+                os.replace(entry, target)
+                shutil.rmtree(backup, ignore_errors=True)
+            elif entry.is_dir() and target.exists():
+                target.unlink()
+                os.replace(entry, target)
+            else:
+                os.replace(entry, target)
+
+    def _verify_files(self) -> Tuple[int, List[str]]:
+        with self.manifest_path.open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError("资源清单版本不匹配")
+        files: Dict[str, Dict[str, int]] = manifest["files"]
+        root = self.target_dir / "mai"
+
+        def check(item) -> Optional[str]:
+            name, expected = item
+            path = root / name
+            try:
+                if path.stat().st_size != expected["size"] or _crc32(path) != expected["crc"]:
+                    return name
+            except OSError:
+                return name
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            bad = [name for name in pool.map(check, files.items()) if name is not None]
+        return len(files), bad
+
+    async def verify(self, progress: Optional[Progress] = None) -> Tuple[bool, str]:
+        """按资源清单并行校验已安装的文件，返回 (是否完整, 说明)"""
+        if not self.manifest_path.exists():
+            return False, "没有找到资源清单，无法校验，请重新下载资源"
+        await _report(progress, "正在校验mai资源...")
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        try:
+            total, bad = await loop.run_in_executor(None, self._verify_files)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            # 清单损坏时无法判断哪些文件可信，按需要重新安装处理
+            return False, f"资源清单无法读取（{e!r}），需要重新下载资源"
+        elapsed = time.monotonic() - started
+        if bad:
+            preview = "、".join(bad[:5])
+            return False, f"校验完成，{total} 个文件中有 {len(bad)} 个缺失或损坏: {preview}{' 等' if len(bad) > 5 else ''}"
+        return True, f"校验完成，{total} 个文件均完整，用时 {elapsed:.1f}s"
+
+
+resource_installer = ResourceInstaller(STATIC_URL, STATIC)
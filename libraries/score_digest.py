@@ -0,0 +1,91 @@
+from collections import Counter
+from statistics import mean
+from typing import Dict, Iterable, List, Optional
+
+from .models import BestList, ChartInfo, diffs
+
+RANK_NAMES = ["D", "C", "B", "BB", "BBB", "A", "AA", "AAA", "S", "S+", "SS", "SS+", "SSS", "SSS+"]
+FC_NAMES = ["", "FC", "FC+", "AP", "AP+"]
+DIFF_SHORT = ["Bas", "Adv", "Exp", "Mas", "ReM"]
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数：中日文字符按 1 个计，其余按 4 个字符 1 个计"""
+    wide = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def _chart_brief(chart: ChartInfo, title_len: int = 16) -> str:
+    title = chart.title if len(chart.title) <= title_len else chart.title[:title_len - 1] + "…"
+    return f"{title}[{DIFF_SHORT[chart.diff]}]{chart.ds:.1f} {chart.achievement:.2f}% RA{chart.rating}"
+
+
+def _list_summary(name: str, charts: List[ChartInfo]) -> str:
+    if not charts:
+        return f"{name}: 无成绩"
+    ds = [c.ds for c in charts]
+    return (
+        f"{name}: {len(charts)}首 均RA{mean(c.rating for c in charts):.0f} "
+        f"均达成{mean(c.achievement for c in charts):.2f}% 定数{min(ds):.1f}~{max(ds):.1f}"
+    )
+
+
+def _distribution(label: str, counter: Counter, order: Iterable[str], limit: Optional[int] = None) -> str:
+    items = [(k, counter[k]) for k in order if counter.get(k)]
+    if limit is not None and len(items) > limit:
+        rest = sum(v for _, v in items[limit:])
+        items = items[:limit] + [("其他", rest)]
+    return f"{label}: " + " ".join(f"{k}×{v}" for k, v in items) if items else f"{label}: 无"
+
+
+class ScoreDigest(object):
+    """
+    把最佳成绩列表压缩成统计摘要，代替逐条列出的成绩文本交给AI锐评。
+
+    摘要包含 Rating 构成、达成率和评级分布、FC/AP 数量、等级分布，以及最高和最低的几首；
+    总长度按 estimate_tokens() 控制在 budget 以内，超出时优先减少列出的曲目。
+    """
+
+    def __init__(self, enabled: bool = False, budget: int = 300, extremes: int = 3):
+        self.enabled = enabled
+        self.budget = budget
+        self.extremes = extremes
+
+    def configure(self, enabled: Optional[bool] = None, budget: Optional[int] = None):
+        if enabled is not None:
+            self.enabled = enabled
+        if budget is not None:
+            self.budget = max(0, budget)
+
+    def render(self, obj: Dict, sd_best: BestList, dx_best: BestList, is_b50: bool = False) -> str:
+        sd = list(sd_best)
+        dx = list(dx_best)
+        charts = sd + dx
+        sd_rating = sum(c.rating for c in sd)
+        dx_rating = sum(c.rating for c in dx)
+        lines = [f"玩家: {obj['nickname']}"]
+        if is_b50:
+            lines.append(f"Rating: {sd_rating + dx_rating} (旧版本B35: {sd_rating} + 新版本B15: {dx_rating})")
+        else:
+            lines.append(f"Rating: {obj['rating'] + obj['additional_rating']} (底分: {obj['rating']} + 段位分: {obj['additional_rating']})")
+        lines.append(_list_summary("旧版本", sd))
+        lines.append(_list_summary("新版本", dx))
+        lines.append(_distribution("评级", Counter(RANK_NAMES[c.scoreId] for c in charts), reversed(RANK_NAMES), limit=4))
+        lines.append(_distribution("连击", Counter(FC_NAMES[c.comboId] or "无" for c in charts), ["AP+", "AP", "FC+", "FC", "无"]))
+        levels = Counter(c.lv for c in charts)
+        lines.append(_distribution("等级", levels, sorted(levels, key=lambda lv: (-levels[lv], lv)), limit=4))
+        lines.append(_distribution("难度", Counter(diffs[c.diff] for c in charts), diffs))
+
+        text = "\n".join(lines)
+        ranked = sorted(charts, key=lambda c: c.rating, reverse=True)
+        for k in range(min(self.extremes, len(ranked) // 2), 0, -1):
+            extra = (
+                "\n最高: " + "; ".join(_chart_brief(c) for c in ranked[:k])
+                + "\n最低: " + "; ".join(_chart_brief(c) for c in ranked[-k:])
+            )
+            if estimate_tokens(text + extra) <= self.budget:
+                return text + extra
+        return text
+
+
+score_digest = ScoreDigest()
@@ -0,0 +1,94 @@
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Tuple
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+# (码位上界, 宽度)，码位不大于上界时取对应宽度，超出最后一项时宽度为1
+_WIDTHS = (
+    (126, 1), (159, 0), (687, 1), (710, 0), (711, 1), (727, 0), (733, 1), (879, 0), (1154, 1), (1161, 0), (4347, 1), (4447, 2), (7467, 1), (7521, 0), (8369, 1), (8426, 0), (9000, 1), (9002, 2), (11021, 1), (12350, 2), (12351, 1), (12438, 2), (12442, 0), (19893, 2), (19967, 1), (55203, 2), (63743, 1), (64106, 2), (65039, 1), (65059, 0), (65131, 2), (65279, 1), (65376, 2), (65500, 1), (65510, 2), (120831, 1), (262141, 2), (1114109, 1),
+)
+_WIDTH_BOUNDS = tuple(num for num, _ in _WIDTHS)
+_WIDTH_VALUES = tuple(wid for _, wid in _WIDTHS) + (1,)
+
+
+def char_width(o: int) -> int:
+    """字符占用的列数，0、1 或 2"""
+    if o == 0xE or o == 0xF:
+        return 0
+    return _WIDTH_VALUES[bisect_left(_WIDTH_BOUNDS, o)]
+
+
+@lru_cache(maxsize=8192)
+def column_width(s: str) -> int:
+    return sum(char_width(ord(ch)) for ch in s)
+
+
+def cut_to_width(s: str, lens: int) -> str:
+    """保留前缀中总列数不超过 lens 的部分"""
+    res = 0
+    for i, ch in enumerate(s):
+        res += char_width(ord(ch))
+        if res > lens:
+            return s[:i]
+    return s
+
+
+@lru_cache(maxsize=8192)
+def truncate(s: str, limit: int, cut: int) -> str:
+    """列数超过 limit 时截到 cut 列并加省略号"""
+    if column_width(s) > limit:
+        return cut_to_width(s, cut) + "..."
+    return s
+
+
+def outline_text(draw: ImageDraw.ImageDraw, pos: Tuple[float, float], text: str, font: ImageFont.FreeTypeFont, fill="white", stroke_fill="black", stroke_width: int = 1):
+    """带描边的文字，一次绘制完成"""
+    draw.text(pos, text, fill, font, stroke_width=stroke_width, stroke_fill=stroke_fill)
+
+
+class TextStripCache(object):
+    """
+    渲染好的单行文字缓存。
+
+    按 (文字, 字体, 字号, 颜色) 保存一张透明底的 RGBA 小图和字形边界框的偏移，以自身 alpha 为遮罩
+    贴到目标位置加偏移处，与直接 draw.text 的结果一致，包括向左、向上超出起点的字形。
+    曲名在大量查询中反复出现，缓存后无需重新排版和光栅化。
+    """
+
+    def __init__(self, max_items: int = 4096):
+        self.max_items = max_items
+        self._strips: "OrderedDict[Tuple, Tuple[Image.Image, Tuple[int, int]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text: str, font: ImageFont.FreeTypeFont, fill="white") -> Tuple[Image.Image, Tuple[int, int]]:
+        """返回文字小图和它相对绘制位置的偏移，偏移即字形边界框的左上角，可能为负"""
+        key = (text, font.path, font.size, fill)
+        with self._lock:
+            strip = self._strips.get(key)
+            if strip is not None:
+                self._strips.move_to_end(key)
+                return strip
+        left, top, right, bottom = font.getbbox(text)
+        # 底色与文字同色、完全透明，贴图时边缘的混合结果与直接绘制一致
+        img = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), ImageColor.getrgb(fill)[:3] + (0,))
+        ImageDraw.Draw(img).text((-left, -top), text, fill, font)
+        strip = (img, (left, top))
+        with self._lock:
+            self._strips[key] = strip
+            while len(self._strips) > self.max_items:
+                self._strips.popitem(last=False)
+        return strip
+
+    def paste(self, img: Image.Image, pos: Tuple[int, int], text: str, font: ImageFont.FreeTypeFont, fill="white"):
+        strip, (left, top) = self.get(text, font, fill)
+        img.paste(strip, (pos[0] + left, pos[1] + top), mask=strip)
+
+    def clear(self):
+        with self._lock:
+            self._strips.clear()
+
+
+text_strips = TextStripCache()
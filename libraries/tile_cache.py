@@ -0,0 +1,138 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+from PIL import Image, ImageFilter
+from astrbot.api import logger
+
+from .path_config import STATIC
+
+PLACEHOLDER_COVER = "01000"
+# 修改模糊或压暗参数时需要递增，使磁盘上的旧卡片失效
+TILE_VERSION = 1
+
+
+class TileCache(object):
+    """
+    成绩卡片背景缓存。
+
+    背景只取决于封面和卡片尺寸：封面缩放到卡片宽度、居中裁剪后，
+    成绩卡片做 GaussianBlur(3) 并压暗到 0.72，空位卡片只做 GaussianBlur(1)。
+    内存中按LRU保留最近使用的卡片，可选地在 STATIC/mai/tile_cache 下落盘，
+    供多个渲染进程共享。get() 返回共享对象，绘制前需要 copy()。
+    """
+
+    def __init__(self, cover_dir: Path, disk_dir: Path, max_items: int = 512, use_disk: bool = True):
+        self.cover_dir = cover_dir
+        self.disk_dir = disk_dir
+        self.max_items = max_items
+        self.use_disk = use_disk
+        self._tiles: "OrderedDict[Tuple[str, int, int, bool], Image.Image]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, max_items: Optional[int] = None, use_disk: Optional[bool] = None):
+        if max_items is not None:
+            self.max_items = max(0, max_items)
+        if use_disk is not None:
+            self.use_disk = use_disk
+        with self._lock:
+            self._evict()
+
+    def resolve(self, cover_id: str) -> str:
+        """实际使用的封面：封面文件不存在时为占位封面"""
+        if (self.cover_dir / f"{cover_id}.png").is_file():
+            return cover_id
+        return PLACEHOLDER_COVER
+
+    def _disk_path(self, cover_id: str, itemW: int, itemH: int, placeholder: bool) -> Path:
+        kind = "empty" if placeholder else "best"
+        return self.disk_dir / f"v{TILE_VERSION}_{kind}_{itemW}x{itemH}" / f"{cover_id}.png"
+
+    def _build(self, cover_id: str, itemW: int, itemH: int, placeholder: bool) -> Image.Image:
+        with Image.open(self.cover_dir / f"{cover_id}.png") as raw:
+            temp = raw.convert("RGB")
+        time = itemW / temp.size[0]
+        temp = temp.resize((int(temp.size[0] * time), int(temp.size[1] * time)))
+        temp = temp.crop((0, (temp.size[1] - itemH) / 2, itemW, (temp.size[1] + itemH) / 2))
+        if placeholder:
+            return temp.filter(ImageFilter.GaussianBlur(1))
+        return temp.filter(ImageFilter.GaussianBlur(3)).point(lambda p: int(p * 0.72))
+
+    def _load_or_build(self, cover_id: str, itemW: int, itemH: int, placeholder: bool) -> Image.Image:
+        if not self.use_disk:
+            return self._build(cover_id, itemW, itemH, placeholder)
+        tile_path = self._disk_path(cover_id, itemW, itemH, placeholder)
+        cover_path = self.cover_dir / f"{cover_id}.png"
+        try:
+            if tile_path.stat().st_mtime >= cover_path.stat().st_mtime:
+                with Image.open(tile_path) as cached:
+                    return cached.convert("RGB")
+        except OSError:
+            pass
+        tile = self._build(cover_id, itemW, itemH, placeholder)
+        try:
+            tile_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = tile_path.with_name(f".{uuid.uuid4().hex}.tmp")
+            tile.save(tmp_path, format="PNG", compress_level=1)
+            os.replace(tmp_path, tile_path)
+        except OSError as e:
+            logger.warning(f"写入卡片缓存失败: {tile_path}, 错误: {e}")
+        return tile
+
+    def _evict(self):
+        while len(self._tiles) > self.max_items:
+            self._tiles.popitem(last=False)
+
+    def get(self, cover_id: str, itemW: int, itemH: int = 88, placeholder: bool = False) -> Image.Image:
+        cover_id = PLACEHOLDER_COVER if placeholder else self.resolve(cover_id)
+        key = (cover_id, itemW, itemH, placeholder)
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                return tile
+        tile = self._load_or_build(cover_id, itemW, itemH, placeholder)
+        if self.max_items:
+            with self._lock:
+                self._tiles[key] = tile
+                self._evict()
+        return tile
+
+    def prewarm(self, cover_ids: Optional[Iterable[str]] = None, sizes: Iterable[Tuple[int, int]] = ((131, 88), (164, 88))) -> int:
+        """预先生成磁盘卡片缓存，阻塞执行，应放在线程中调用。返回新生成的数量"""
+        if not self.use_disk:
+            return 0
+        if cover_ids is None:
+            cover_ids = [p.stem for p in self.cover_dir.glob("*.png")]
+        built = 0
+        for itemW, itemH in sizes:
+            for placeholder in (False, True):
+                self._prewarm_one(PLACEHOLDER_COVER, itemW, itemH, placeholder)
+            for cover_id in cover_ids:
+                tile_path = self._disk_path(cover_id, itemW, itemH, False)
+                try:
+                    if tile_path.stat().st_mtime >= (self.cover_dir / f"{cover_id}.png").stat().st_mtime:
+                        continue
+                except OSError:
+                    pass
+                if self._prewarm_one(cover_id, itemW, itemH, False):
+                    built += 1
+        return built
+
+    def _prewarm_one(self, cover_id: str, itemW: int, itemH: int, placeholder: bool) -> bool:
+        try:
+            self._load_or_build(cover_id, itemW, itemH, placeholder).close()
+            return True
+        except Exception as e:
+            logger.warning(f"预生成卡片缓存失败: {cover_id}, 错误: {e}")
+            return False
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+
+
+tile_cache = TileCache(STATIC / "mai" / "cover", STATIC / "mai" / "tile_cache")
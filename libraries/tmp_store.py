@@ -0,0 +1,89 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+from astrbot.api import logger
+
+from .path_config import STATIC
+
+
+class TmpStore(object):
+    """
+    发送图片用的临时文件。
+
+    只有平台必须以文件路径发送时才会用到。文件写入在线程池中进行，
+    超过 ttl 秒或总大小超过 max_bytes 时从最旧的开始删除；启动时清空上次遗留的文件。
+    """
+
+    def __init__(self, tmp_dir: Path, ttl: float = 300, max_bytes: int = 64 * 1024 * 1024):
+        self.tmp_dir = tmp_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._files: "OrderedDict[Path, Tuple[float, int]]" = OrderedDict()
+        self._total = 0
+
+    def configure(self, ttl: Optional[float] = None, max_bytes: Optional[int] = None):
+        if ttl is not None:
+            self.ttl = max(0, ttl)
+        if max_bytes is not None:
+            self.max_bytes = max(0, max_bytes)
+
+    def cleanup(self) -> int:
+        """删除目录下的所有文件，阻塞执行。返回删除的数量"""
+        removed = 0
+        if self.tmp_dir.exists():
+            for path in self.tmp_dir.iterdir():
+                if path.is_file():
+                    path.unlink(missing_ok=True)
+                    removed += 1
+        self._files.clear()
+        self._total = 0
+        if removed:
+            logger.info(f"已清理 {removed} 个遗留的临时文件")
+        return removed
+
+    def _expired(self, now: float, keep: int):
+        expired = []
+        while len(self._files) > keep:
+            path, (created, size) = next(iter(self._files.items()))
+            if now - created < self.ttl and self._total <= self.max_bytes:
+                break
+            self._files.popitem(last=False)
+            self._total -= size
+            expired.append(path)
+        return expired
+
+    @staticmethod
+    def _remove(paths):
+        for path in paths:
+            try:
+                path.unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning(f"删除临时文件失败: {path}, 错误: {e}")
+
+    def _write(self, path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    async def put(self, data: bytes, suffix: str = ".png") -> Path:
+        path = self.tmp_dir / f"{uuid.uuid4().hex}{suffix}"
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write, path, data)
+        self._files[path] = (time.monotonic(), len(data))
+        self._total += len(data)
+        # 刚写入的文件还没发送，不参与这次清理
+        await self.sweep(keep=1)
+        return path
+
+    async def sweep(self, keep: int = 0):
+        """删除过期或超出容量的文件，保留最新的 keep 个"""
+        expired = self._expired(time.monotonic(), keep)
+        if expired:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._remove, expired)
+
+
+tmp_store = TmpStore(STATIC / "tmp")
@@ -1,22 +1,40 @@
 from astrbot.api.event import filter, AstrMessageEvent
-from astrbot.api.star import Context, Star, register
+from astrbot.api.star import Star, register
 from astrbot.api import logger
 from astrbot.api.message_components import *
-from typing import List, Dict, Optional, Tuple, Any
+import astrbot.api.message_components as Comp
+from typing import Dict, Optional, Tuple, Any
 from pathlib import Path
-import uuid
+import time
 import re
+import random
 import json
-from .libraries.image import DrawBest
-from .libraries.image_generator import generate, handle_oneshot_command
+from .libraries.image_generator import (
+    cached_oneshot_data, format_score_text, generate_oneshot_data, parse_best_lists, player_cache, player_key, prepare_scores, query_player, render_history,
+    render_job, render_job_incremental, render_job_key,
+)
+from .libraries.metrics import SizeHistogram, metrics
+from .libraries.circuit_breaker import CircuitBreaker
+from .libraries.ai_comment import comment_cache, comment_key, provider_limiter
+from .libraries.score_digest import estimate_tokens, score_digest
+from .libraries.image_cache import image_cache
+from .libraries.render_service import RenderService, RenderBusyError
+from .libraries.assets import assets
+from .libraries.tile_cache import tile_cache
+from .libraries.text_layout import text_strips
+from .libraries.cover_sync import cover_sync
+from .libraries.tmp_store import tmp_store
+from .libraries.encoder import guess_suffix, image_encoder
+from .libraries.http_client import http
 from .libraries.maimaidx_music import *
-from .libraries.utils import hash_
-from .libraries.path_config import STATIC
 from .libraries.models import *
 from .public import *
 from .api import *
 import asyncio
 
+# OneShot连续失败后暂停请求，避免每次都等到超时
+oneshot_breaker = CircuitBreaker("OneShot")
+
 @register("astrbot_plugin_maimaidx", "0xa7973908", "A maimaidx helper for Astrbot.", "1.1")
 class MyPlugin(Star):
     @filter.command("b50", priority = 1)
@@ -28,6 +46,7 @@ class MyPlugin(Star):
         at_messages = [comp for comp in event.message_obj.message if isinstance(comp, At)]
         plain_text = event.message_str.strip()
         username = plain_text.split(" ", 1)[1] if " " in plain_text else ""
+        username, force = self._split_force_flag(username)
         at_id = at_messages[0].qq if at_messages else None
 
         # 构造 payload
@@ -37,28 +56,10 @@ class MyPlugin(Star):
             payload = {"username": username, "b50": 1}
         else:
             payload = {"qq": str(user_id), "b50": 1}
-        logger.info(f"Payload: {payload}")
+        logger.info(f"Payload: {payload}, 强制刷新: {force}")
 
         use_web_generator = self.context._config.get('web_image_generator', True)
-        if use_web_generator:
-            try:
-                logger.info("尝试使用OneShot逻辑生成B50图片")
-                result = await handle_oneshot_command(payload, is_b50=True)
-                if result:
-                    oneshot_path, text_result = result
-                    yield event.image_result(oneshot_path)
-                    
-                    ai_comment = await self.getAIComment(text_result, event)
-                    if isinstance(ai_comment, str) and ai_comment:
-                        yield event.plain_result(ai_comment)
-                    return
-                else:
-                    logger.warning("OneShot生成失败，回退到本地生成")
-            except Exception as e:
-                logger.error(f"OneShot生成时发生错误，回退到本地生成: {e}")
-        
-        # B50本地生成逻辑 (回退)
-        async for result in self._generate_local_image(event, payload, is_b50=True):
+        async for result in self._generate_image(event, payload, is_b50=True, force=force, remote=use_web_generator):
             yield result
 
     @filter.command("b40", priority = 1)
@@ -69,6 +70,7 @@ class MyPlugin(Star):
         at_messages = [comp for comp in event.message_obj.message if isinstance(comp, At)]
         plain_text = event.message_str.strip()
         username = plain_text.split(" ", 1)[1] if " " in plain_text else ""
+        username, force = self._split_force_flag(username)
         at_id = at_messages[0].qq if at_messages else None
 
         if at_id:
@@ -77,30 +79,48 @@ class MyPlugin(Star):
             payload = {"username": username, "b50": 0}
         else:
             payload = {"qq": str(user_id), "b50": 0}
-        logger.info(f"Payload: {payload}")
+        logger.info(f"Payload: {payload}, 强制刷新: {force}")
         
-        async for result in self._generate_local_image(event, payload, is_b50=False):
+        async for result in self._generate_image(event, payload, is_b50=False, force=force):
             yield result
             
-    async def _generate_local_image(self, event: AstrMessageEvent, payload: dict, is_b50: bool):
-        """本地生成B40/B50图片"""
-        tmp_path = None
-        img = None
+    @staticmethod
+    def _split_force_flag(args: str) -> Tuple[str, bool]:
+        """从参数中去掉 -f/--force，返回剩余参数和是否强制刷新"""
+        tokens = args.split()
+        force = any(t in ("-f", "--force") for t in tokens)
+        if force:
+            args = " ".join(t for t in tokens if t not in ("-f", "--force"))
+        return args, force
+
+    async def _generate_image(self, event: AstrMessageEvent, payload: dict, is_b50: bool, force: bool = False, remote: bool = False):
+        """查询成绩并生成B40/B50图片，remote=True 时与OneShot对冲"""
+        comment_task = None
+        started = time.perf_counter()
         try:
-            img, success, text_result = await generate(payload, is_b50)
+            success, sd_best, dx_best, text_result, job = await prepare_scores(payload, is_b50, force)
             
             if success == 400:
                 yield event.plain_result("未找到此玩家，请确保此玩家的用户名和查分器中的用户名相同。")
             elif success == 403:
                 yield event.plain_result("该用户禁止了其他人获取数据。")
-            elif success == 0 and img and text_result:
-                tmp_dir = STATIC / "tmp"
-                tmp_dir.mkdir(exist_ok=True)
-                tmp_path = tmp_dir / f"{uuid.uuid4()}.png"
-                img.save(tmp_path)
-                yield event.image_result(str(tmp_path))
+            elif success == 0 and job and text_result:
+                # 拿到成绩文本后立即开始锐评，与渲染和发送图片同时进行
+                comment_task = asyncio.ensure_future(self.getAIComment(text_result, event))
+                try:
+                    if remote:
+                        png_data = await self._race_render(sd_best, dx_best, job, player_key(payload))
+                    else:
+                        png_data = await self._render_local(job, player_key(payload))
+                except RenderBusyError as e:
+                    logger.warning(f"{e}")
+                    yield event.plain_result("当前查分的人太多了，请稍后再试。")
+                    return
+                with metrics.stage("send"):
+                    yield await self._image_result(event, png_data)
                 
-                ai_comment = await self.getAIComment(text_result, event)
+                ai_comment = await comment_task
+                comment_task = None
                 if isinstance(ai_comment, str) and ai_comment:
                     yield event.plain_result(ai_comment)
             else:
@@ -112,24 +132,138 @@ class MyPlugin(Star):
             logger.error(f"本地图片生成过程中发生错误: {str(e)}")
             yield event.plain_result(f"查询过程中发生错误，请稍后再试或联系管理员。错误信息：{str(e)}")
         finally:
-            if img:
-                img.close()
-            if tmp_path:
-                # 使用 asyncio.run_in_executor 来检查文件是否存在
-                loop = asyncio.get_event_loop()
-                file_exists = await loop.run_in_executor(None, lambda: tmp_path.exists())
-                if file_exists:
-                    try:
-                        # 使用 asyncio.run_in_executor 来删除文件
-                        await loop.run_in_executor(None, lambda: tmp_path.unlink())
-                    except Exception as e:
-                        logger.error(f"删除临时文件失败: {str(e)}")
+            if comment_task is not None:
+                comment_task.cancel()
+            metrics.record("total_b50" if is_b50 else "total_b40", time.perf_counter() - started)
+
+    async def _render_local(self, job: Dict[str, Any], player: Optional[Tuple] = None) -> bytes:
+        """本地渲染，优先使用图片缓存。player 为 player_key()，用于取出该玩家上一次的画布只重绘变化的卡片"""
+        cache_key = render_job_key(job)
+        image_data = await image_cache.get(cache_key)
+        if image_data:
+            logger.info("本地图片命中缓存")
+            return image_data
+        service = self._get_render_service()
+        with metrics.timer("local_render"):
+            if player is not None and render_history.maxsize > 0:
+                image_data, encode_time, state, _ = await service.render_incremental(job, render_history.get(player))
+                render_history.set(player, state)
+            else:
+                image_data, encode_time = await service.render(job)
+        metrics.record("encode", encode_time)
+        metrics.record("image_size", len(image_data), SizeHistogram)
+        await image_cache.put(cache_key, image_data)
+        return image_data
+
+    async def _render_oneshot(self, sd_best: BestList, dx_best: BestList) -> Optional[bytes]:
+        """请求OneShot图片，记录延迟和熔断器状态。缓存已在 _race_render 中查过，这里只统计真实请求"""
+        started = time.perf_counter()
+        try:
+            data = await generate_oneshot_data(sd_best, dx_best, "PRiSM", "cn", use_cache=False)
+        except asyncio.CancelledError:
+            # 没有完成的请求不计入 oneshot 延迟；被本地渲染抢先的情况由 _race_render 记为失败
+            oneshot_breaker.release()
+            raise
+        except Exception as e:
+            logger.error(f"OneShot生成时发生错误: {e}")
+            data = None
+        metrics.histogram("oneshot").observe(time.perf_counter() - started)
+        if data:
+            oneshot_breaker.record_success()
+        else:
+            oneshot_breaker.record_failure()
+        return data
+
+    def _hedge_delay(self) -> Optional[float]:
+        """OneShot超过这个时间没有返回就同时开始本地渲染，None 表示一直等待"""
+        if not self.context._config.get('hedge_render', True):
+            return None
+        default = self.context._config.get('hedge_delay', 3.0)
+        quantile = self.context._config.get('hedge_quantile', 0.9)
+        recent = metrics.histogram("oneshot").quantile(quantile, min_samples=10)
+        return max(0.2, recent) if recent is not None else default
+
+    async def _race_render(self, sd_best: BestList, dx_best: BestList, job: Dict[str, Any], player: Optional[Tuple] = None) -> bytes:
+        """
+        先请求OneShot，超过对冲延迟仍未返回时同时开始本地渲染，取先完成的结果并取消另一个。
+        熔断器断开时直接本地渲染
+        """
+        # 缓存命中不经过熔断器和延迟统计，以免拉低对冲延迟、掩盖连续失败
+        cached = await cached_oneshot_data(sd_best, dx_best, "PRiSM", "cn")
+        if cached:
+            logger.info("OneShot图片命中缓存")
+            return cached
+        tasks = []
+        remote = None
+        if oneshot_breaker.allow():
+            logger.info("尝试使用OneShot逻辑生成B50图片")
+            remote_started = time.perf_counter()
+            remote = asyncio.ensure_future(self._render_oneshot(sd_best, dx_best))
+            tasks.append(remote)
+            try:
+                data = await asyncio.wait_for(asyncio.shield(remote), self._hedge_delay())
+                if data:
+                    return data
+                logger.warning("OneShot生成失败，回退到本地生成")
+                tasks.remove(remote)
+            except asyncio.TimeoutError:
+                logger.info("OneShot响应较慢，同时开始本地生成")
+            except BaseException:
+                remote.cancel()
+                raise
+        else:
+            logger.info("OneShot已熔断，直接本地生成")
+        tasks.append(asyncio.ensure_future(self._render_local(job, player)))
+
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif task.result():
+                        if remote is not None and remote in pending:
+                            # 本地渲染先完成，OneShot超出对冲预算，记为一次失败。
+                            # 被截断的耗时单独记录，不进入决定对冲延迟的 oneshot 直方图
+                            metrics.histogram("oneshot_hedged").observe(time.perf_counter() - remote_started)
+                            oneshot_breaker.record_failure()
+                        return task.result()
+            raise error if error is not None else RuntimeError("OneShot和本地生成均失败")
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _image_result(self, event: AstrMessageEvent, data: bytes):
+        """构造图片消息，默认直接发送内存中的图片，关闭 image_in_memory 时写入临时文件"""
+        if self.context._config.get('image_in_memory', True):
+            return event.chain_result([Comp.Image.fromBytes(data)])
+        tmp_path = await tmp_store.put(data, guess_suffix(data))
+        return event.image_result(str(tmp_path))
+
+    def _get_render_service(self) -> RenderService:
+        """获取本地渲染服务，未初始化时按配置创建"""
+        if not hasattr(self, 'render_service'):
+            tile_options = {
+                "max_items": self.context._config.get('tile_cache_size', 512),
+                "use_disk": self.context._config.get('tile_cache_disk', True),
+            }
+            tile_cache.configure(**tile_options)
+            self.render_service = RenderService(
+                workers=self.context._config.get('render_workers', 2),
+                queue_size=self.context._config.get('render_queue_size', 8),
+                options={"tile_cache": tile_options},
+            )
+            self.render_service.start()
+        return self.render_service
 
     @filter.command("maihelp", aliases={"舞萌帮助", "mai帮助"}, priority = 1)
     async def help_msg(self, event: AstrMessageEvent):
         help_str = """可用命令如下：
             b50 查看自己的B50
-            b40 查看自己的B40"""
+            b40 查看自己的B40
+            在指令后加 -f 可跳过缓存重新查询"""
         yield event.plain_result(help_str)
 
     async def _update_pl_background(self):
@@ -141,21 +275,168 @@ class MyPlugin(Star):
         except Exception as e:
             logger.error(f"后台更新机厅信息失败: {e}")
 
+    async def _prewarm_tiles_background(self):
+        try:
+            loop = asyncio.get_event_loop()
+            built = await loop.run_in_executor(None, tile_cache.prewarm)
+            logger.info(f"封面卡片缓存预生成完成，新生成 {built} 张")
+        except Exception as e:
+            logger.error(f"封面卡片缓存预生成失败: {e}")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
     @filter.command("checkmai", aliases={"检查mai资源"}, priority = 1)
     async def checkmai(self, event: AstrMessageEvent):
-        """检查mai资源"""
+        """检查mai资源，参数“校验”按清单校验已有文件，“重装”强制重新下载"""
+        plain_text = event.message_str.strip()
+        mode = plain_text.split(" ", 1)[1].strip() if " " in plain_text else ""
         yield event.plain_result("正在检查资源，请稍等...")
-        msg = await check_mai()
+
+        async def progress(text: str):
+            await event.send(event.plain_result(text))
+
+        if mode in ("校验", "verify"):
+            installed, msg = await verify_mai(progress)
+        else:
+            installed, msg = await check_mai(force=mode in ("重装", "force"), progress=progress)
+        if installed:
+            assets.reload()
+            tile_cache.clear()
+            text_strips.clear()
+            render_history.clear()
+            await image_cache.clear()
+            if hasattr(self, 'render_service'):
+                # 让渲染进程重新载入资源
+                self.render_service.restart()
         yield event.plain_result(msg)
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("maistats", aliases={"查分统计"}, priority = 1)
+    async def stats(self, event: AstrMessageEvent):
+        """查看查分各阶段的延迟分布、图片大小和熔断器状态，加参数 prom 输出 Prometheus 文本"""
+        plain_text = event.message_str.strip()
+        mode = plain_text.split(" ", 1)[1].strip() if " " in plain_text else ""
+        if mode in ("prom", "prometheus", "导出"):
+            path = self.context._config.get('metrics_export_path', '')
+            if path:
+                await asyncio.get_running_loop().run_in_executor(None, metrics.export, path)
+                yield event.plain_result(f"已写入 {path}")
+            else:
+                yield event.plain_result(metrics.prometheus())
+            return
+        lines = [
+            metrics.summary() or "暂无延迟数据",
+            f"OneShot熔断器: {oneshot_breaker.state}，连续失败 {oneshot_breaker.failures} 次",
+            f"对冲延迟: {self._hedge_delay() or '不对冲'}",
+        ]
+        if not metrics.enabled:
+            lines.append("分阶段统计未开启（配置项 metrics_enabled）")
+        yield event.plain_result("\n".join(lines))
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("maibench", aliases={"渲染测试"}, priority = 1)
+    async def render_bench(self, event: AstrMessageEvent):
+        """用自己的B50对比完整绘制和只重绘变化卡片的耗时"""
+        status, _, _, _, job = await prepare_scores({"qq": str(event.get_sender_id()), "b50": 1}, is_b50=True)
+        if status != 0 or not job:
+            yield event.plain_result(f"查询失败，错误代码：{status}")
+            return
+        yield event.plain_result("正在测试，请稍等...")
+        loop = asyncio.get_running_loop()
+        _, _, state, _ = await loop.run_in_executor(None, render_job_incremental, job, None)
+        charts = job["sd"] + job["dx"]
+
+        lines = ["变化卡片 | 完整绘制 | 增量绘制 | 结果一致"]
+        for changed in (0, 1, 5, 10, 25, 50):
+            # 只改动达成率的末位，不影响排名，模拟刷新了几首歌的成绩
+            picked = set(random.sample(range(len(charts)), min(changed, len(charts))))
+            mutated = [dict(c, achievement=round(c["achievement"] + 0.0001, 4)) if i in picked else c for i, c in enumerate(charts)]
+            bench_job = dict(job, sd=mutated[:len(job["sd"])], dx=mutated[len(job["sd"]):])
+            started = time.perf_counter()
+            full, _ = await loop.run_in_executor(None, render_job, bench_job)
+            full_time = time.perf_counter() - started
+            started = time.perf_counter()
+            partial, _, _, _ = await loop.run_in_executor(None, render_job_incremental, bench_job, state)
+            partial_time = time.perf_counter() - started
+            lines.append(f"{len(picked)} | {full_time * 1000:.0f}ms | {partial_time * 1000:.0f}ms | {'是' if full == partial else '否'}")
+        yield event.plain_result("\n".join(lines))
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("maidigest", aliases={"锐评对比"}, priority = 1)
+    async def digest_bench(self, event: AstrMessageEvent):
+        """用自己的B50对比逐条成绩文本和统计摘要的prompt大小与锐评耗时"""
+        status, obj = await query_player({"qq": str(event.get_sender_id()), "b50": 1})
+        if status != 200:
+            yield event.plain_result(f"查询失败，错误代码：{status}")
+            return
+        sd_best, dx_best = await parse_best_lists(obj, is_b50=True)
+        prov = self.context.get_using_provider(umo=event.unified_msg_origin)
+        timeout = self.context._config.get('ai_comment_timeout', 60)
+        yield event.plain_result("正在对比，需要分别请求两次AI锐评，请稍等...")
+
+        lines = []
+        for name, score in (
+            ("逐条", format_score_text(obj, sd_best, dx_best, True)),
+            ("摘要", score_digest.render(obj, sd_best, dx_best, True)),
+        ):
+            prompt, context, system_prompt = self._build_prompt(score)
+            prompt_tokens = estimate_tokens(system_prompt + prompt + "".join(m["content"] for m in context))
+            line = f"{name}: 成绩文本约 {estimate_tokens(score)} tokens，完整prompt约 {prompt_tokens} tokens"
+            if prov:
+                # 不经过缓存，测量实际的请求耗时
+                started = time.perf_counter()
+                try:
+                    await asyncio.wait_for(self._request_comment(prov, prompt, context, system_prompt), timeout)
+                    line += f"，锐评耗时 {time.perf_counter() - started:.1f}s"
+                except Exception as e:
+                    line += f"，锐评失败: {e!r}"
+            lines.append(line)
+        yield event.plain_result("\n".join(lines))
+
     async def terminate(self):
         """可选择实现异步的插件销毁方法，当插件被卸载/停用时会调用。"""
         if hasattr(self, 'update_task'):
             self.update_task.cancel()
+        if hasattr(self, 'prewarm_task'):
+            self.prewarm_task.cancel()
+        if hasattr(self, 'metrics_task'):
+            self.metrics_task.cancel()
+        if hasattr(self, 'render_service'):
+            self.render_service.shutdown()
+        await http.close()
         logger.info("MaimaiDX插件已终止")
     
     async def initialize(self):
         """异步的插件初始化"""
+        await http.open()
+        player_cache.configure(
+            ttl=self.context._config.get('player_cache_ttl', 60),
+            maxsize=self.context._config.get('player_cache_size', 256),
+        )
+        image_cache.configure(self.context._config.get('image_cache_mb', 200) * 1024 * 1024)
+        cover_sync.configure(concurrency=self.context._config.get('cover_concurrency', 8))
+        comment_cache.configure(ttl=self.context._config.get('ai_comment_cache_ttl', 3600))
+        oneshot_breaker.configure(
+            failure_threshold=self.context._config.get('oneshot_failure_threshold', 3),
+            cooldown=self.context._config.get('oneshot_cooldown', 120),
+        )
+        score_digest.configure(
+            enabled=self.context._config.get('ai_score_digest', False),
+            budget=self.context._config.get('ai_digest_tokens', 300),
+        )
+        provider_limiter.configure(self.context._config.get('ai_comment_concurrency', 2))
+        render_history.configure(maxsize=self.context._config.get('incremental_players', 8))
+        metrics.configure(enabled=self.context._config.get('metrics_enabled', True))
+        image_encoder.configure(
+            format=self.context._config.get('image_format', 'png'),
+            quality=self.context._config.get('image_quality', 85),
+            compress_level=self.context._config.get('png_compress_level', 6),
+            scale=self.context._config.get('image_scale', 1.0),
+        )
+        tmp_store.configure(
+            ttl=self.context._config.get('tmp_file_ttl', 300),
+            max_bytes=self.context._config.get('tmp_dir_mb', 64) * 1024 * 1024,
+        )
+        await asyncio.get_running_loop().run_in_executor(None, tmp_store.cleanup)
         await check_mai()
 
         # 将机厅信息更新放入后台任务，防止阻塞初始化
@@ -163,7 +444,7 @@ class MyPlugin(Star):
 
         # 音乐数据初始化
         try:
-            await initialize_music_data()
+            await ensure_initialized()
             logger.info("音乐数据初始化成功")
         except Exception as e:
             logger.error(f"音乐数据初始化失败: {e}")
@@ -180,8 +461,20 @@ class MyPlugin(Star):
             logger.info("AI prompt配置加载成功")
         except Exception as e:
             logger.error(f"AI prompt配置加载失败: {e}")
+
+        # 启动本地渲染进程池
+        try:
+            self._get_render_service()
+        except Exception as e:
+            logger.error(f"渲染服务启动失败: {e}")
+
+        # 后台预生成封面卡片缓存
+        self.prewarm_task = asyncio.create_task(self._prewarm_tiles_background())
             
         self.update_task = asyncio.create_task(self.periodic_update())
+
+        if self.context._config.get('metrics_export_path', ''):
+            self.metrics_task = asyncio.create_task(self._export_metrics_background())
     
     def load_prompts(self):
         """加载AI prompt配置"""
@@ -196,48 +489,88 @@ class MyPlugin(Star):
     async def periodic_update(self):
         while True:
             await asyncio.sleep(3600)  # 每小时更新一次
-            await update_pl()
+            try:
+                await update_pl()
+            except Exception as e:
+                logger.error(f"更新机厅信息失败: {e}")
+            try:
+                await refresh_music_data()
+            except Exception as e:
+                logger.error(f"更新曲目数据失败: {e}")
+            await tmp_store.sweep()
     
+    async def _export_metrics_background(self):
+        """定期把延迟统计写入 Prometheus 文本文件"""
+        path = self.context._config.get('metrics_export_path', '')
+        interval = max(5, self.context._config.get('metrics_export_interval', 60))
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(None, metrics.export, path)
+            except Exception as e:
+                logger.error(f"导出延迟统计失败: {e}")
+
     async def getAIComment(self, score: str, event: AstrMessageEvent) -> str:
         prov = self.context.get_using_provider(umo=event.unified_msg_origin)
         if not prov:
             return "找不到可用的AI模型，主播今天先下播了。"
         
         try:
-            # 从配置中获取prompt
-            if hasattr(self, 'prompts') and 'maimai_comment' in self.prompts:
-                prompt_config = self.prompts['maimai_comment']
-                prompt = prompt_config['prompt'].format(score=score)
-                context = prompt_config['context']
-                system_prompt = prompt_config['system_prompt']
-            else:
-                # 如果没有配置或加载失败，使用默认值
-                logger.warning("使用默认prompt配置")
-                prompt = f"在直播中，一位观众发送了自己的舞萌成绩，希望你锐评一下。请将所有锐评内容放在一段话里，字数少于300，用最少的语言呈现最多的信息和最强的攻击性。语气要平静，不要使用语气词和感叹号。可以添加（停顿）（喝水）（吃东西）。不要使用换行符。不要在末尾使用\"总结：\"及类似的词。可以尽可能多地化用上下文中你的原句，尽可能多地直接使用上下文中你用过的词。观众的成绩为：\n{score}"
-                context = [
-                    {"role": "user", "content": "在一局LoL排位赛中，盲僧刷三狼来的比对面巨魔慢了一步导致你的佐伊被其击杀"},
-                    {"role": "assistant", "content": "这打野的走位我就觉得NMB离谱！你老想着刷你那B三狼干什么玩意啊！"}
-                ]
-                system_prompt = "你是侯国玉，是中国的《英雄联盟》主播、职业选手（你觉得你是）。"
-            
-            llm_resp = await prov.text_chat(
-                prompt=prompt,
-                context=context,
-                system_prompt=system_prompt
-            )
-            # 更健壮的响应解析方式
-            llm_text = self._extract_text_from_response(llm_resp)
+            prompt, context, system_prompt = self._build_prompt(score)
+            timeout = self.context._config.get('ai_comment_timeout', 60)
+            with metrics.stage("ai_comment"):
+                llm_text = await comment_cache.get_or_fetch(
+                    comment_key(prompt, context, system_prompt),
+                    lambda: asyncio.wait_for(self._request_comment(prov, prompt, context, system_prompt), timeout),
+                    cacheable=lambda text: bool(text),
+                )
             if llm_text:
-                # 移除所有可能的换行符
-                llm_text = llm_text.replace('\\n', ' ').replace('\n', ' ')
-                logger.info(f"AI锐评原文: {llm_text}")
                 return llm_text
             else:
-                logger.error(f"无法从AI响应中提取文本")
+                logger.error("无法从AI响应中提取文本")
                 return "AI的回复格式不对，主播翻译不了了。"
+        except asyncio.TimeoutError:
+            logger.error("AI锐评超时")
+            return "主播掉线了，这次锐评不了了。"
         except Exception as e:
             logger.error(f"AI锐评时发生错误: {e}")
             return "哎呀，主播没吃够韭菜盒子，锐评不了了。"
+
+    def _build_prompt(self, score: str) -> Tuple[str, list, str]:
+        """按 prompt_default.json 生成锐评的 prompt、上下文和系统提示词"""
+        # 从配置中获取prompt
+        if hasattr(self, 'prompts') and 'maimai_comment' in self.prompts:
+            prompt_config = self.prompts['maimai_comment']
+            prompt = prompt_config['prompt'].format(score=score)
+            context = prompt_config['context']
+            system_prompt = prompt_config['system_prompt']
+        else:
+            # 如果没有配置或加载失败，使用默认值
+            logger.warning("使用默认prompt配置")
+            prompt = f"在直播中，一位观众发送了自己的舞萌成绩，希望你锐评一下。请将所有锐评内容放在一段话里，字数少于300，用最少的语言呈现最多的信息和最强的攻击性。语气要平静，不要使用语气词和感叹号。可以添加（停顿）（喝水）（吃东西）。不要使用换行符。不要在末尾使用\"总结：\"及类似的词。可以尽可能多地化用上下文中你的原句，尽可能多地直接使用上下文中你用过的词。观众的成绩为：\n{score}"
+            context = [
+                {"role": "user", "content": "在一局LoL排位赛中，盲僧刷三狼来的比对面巨魔慢了一步导致你的佐伊被其击杀"},
+                {"role": "assistant", "content": "这打野的走位我就觉得NMB离谱！你老想着刷你那B三狼干什么玩意啊！"}
+            ]
+            system_prompt = "你是侯国玉，是中国的《英雄联盟》主播、职业选手（你觉得你是）。"
+        return prompt, context, system_prompt
+
+    async def _request_comment(self, prov, prompt: str, context: list, system_prompt: str) -> Optional[str]:
+        """向模型请求锐评，同一个提供商同时进行的请求数受 ai_comment_concurrency 限制"""
+        async with provider_limiter(prov):
+            llm_resp = await prov.text_chat(
+                prompt=prompt,
+                context=context,
+                system_prompt=system_prompt
+            )
+        # 更健壮的响应解析方式
+        llm_text = self._extract_text_from_response(llm_resp)
+        if llm_text:
+            # 移除所有可能的换行符
+            llm_text = llm_text.replace('\\n', ' ').replace('\n', ' ')
+            logger.info(f"AI锐评原文: {llm_text}")
+        return llm_text
     
     def _extract_text_from_response(self, response: Any) -> Optional[str]:
         """从AI响应中提取文本，使用更健壮的方式"""
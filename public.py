@@ -1,105 +1,53 @@
-import time
-import zipfile
-from pathlib import Path
-from typing import List, Set, Union
+from typing import Optional, Tuple
 from astrbot.api import logger
-import aiofiles
-import httpx
 from .api import update_pl
+from .libraries.cover_sync import cover_sync
+from .libraries.image_cache import image_cache
+from .libraries.resource_installer import Progress, resource_installer
 from .libraries.image import *
 
 
 
-async def check_mai(force: bool = False):  # noqa: FBT001
-    """检查mai资源"""
+async def check_mai(force: bool = False, progress: Optional[Progress] = None) -> Tuple[bool, str]:  # noqa: FBT001
+    """
+    检查mai资源，缺失或 force=True 时下载安装。progress 用于向发起者发送进度。
+    返回 (是否安装了新资源, 说明)
+    """
     await update_pl()  # 获取json文件
-    if not Path(STATIC).joinpath("mai/pic").exists() or force:
+    if not resource_installer.installed or force:
+        if resource_installer.busy:
+            return False, "mai资源正在下载中，请稍后再试"
         logger.info("初次使用，正在尝试自动下载资源\n资源包大小预计90M")
         try:
-            async with httpx.AsyncClient() as client:
-                async with client.stream("GET", "https://www.diving-fish.com/maibot/static.zip") as response:
-                    total_size = int(response.headers["Content-Length"])
-                    downloaded_size = 0
-                    last_update_time = time.time()
-                    async with aiofiles.open("static.zip", "wb") as f:
-                        async for chunk in response.aiter_bytes():
-                            await f.write(chunk)
-                            downloaded_size += len(chunk)
-                            current_time = time.time()
-                            if current_time - last_update_time >= 1:
-                                progress = downloaded_size / total_size * 100
-                                logger.info(f"下载进度: {progress:.2f}%")
-                                last_update_time = current_time
-            
-            logger.info("已成功下载，正在尝试解压mai资源")
-            with zipfile.ZipFile("static.zip", "r") as zip_file:
-                zip_file.extractall(Path("data/maimai"))
-            logger.info("mai资源已完整，尝试删除缓存")
-            Path("static.zip").unlink()  # 删除下载的压缩文件
-            msg = "mai资源下载成功，请使用【mai帮助】获取指令"
-
+            return True, await resource_installer.install(progress)
         except Exception as e:
             logger.warning(f"自动下载出错\n{e}\n请自行尝试手动下载")
-            msg = f"自动下载出错\n{e}\n请自行尝试手动下载"
-        return msg
+            return False, f"自动下载出错\n{e}\n请再次使用【检查mai资源】继续下载，或自行尝试手动下载"
     logger.info("已经成功下载，无需重复下载")
-    return "已经成功下载，无需重复下载"
-import asyncio
-from bs4 import BeautifulSoup
+    return False, "已经成功下载，无需重复下载"
 
-COVER_URL = "https://www.diving-fish.com/covers/"
 
-async def download_cover(client: httpx.AsyncClient, url: str, path: Path):
-    """下载单个封面文件"""
-    try:
-        response = await client.get(url)
-        if response.status_code == 200:
-            async with aiofiles.open(path, "wb") as f:
-                await f.write(response.content)
-            return True
-        return False
-    except Exception as e:
-        logger.error(f"下载封面失败: {url}, 错误: {e}")
-        return False
+async def verify_mai(progress: Optional[Progress] = None) -> Tuple[bool, str]:
+    """按资源清单校验mai资源，有缺失或损坏时重新安装。返回值同 check_mai"""
+    if not resource_installer.manifest_path.exists():
+        # 旧版本安装的资源没有清单，无法判断是否损坏，由管理员决定是否重装
+        return False, "没有找到资源清单（较早安装的资源不包含清单），无法校验。如需重新安装请使用【检查mai资源 重装】"
+    ok, msg = await resource_installer.verify(progress)
+    if ok:
+        return False, msg
+    logger.warning(msg)
+    if progress is not None:
+        await progress(msg)
+    return await check_mai(force=True, progress=progress)
+
 
 async def update_covers():
     """检查并更新缺失的封面图片"""
-    cover_dir = Path("data/maimai/mai/cover")
-    if not cover_dir.exists():
-        cover_dir.mkdir(parents=True, exist_ok=True)
-        logger.info(f"创建封面目录: {cover_dir}")
-
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(COVER_URL)
-            if response.status_code != 200:
-                logger.error(f"无法访问封面索引页面: {COVER_URL}")
-                return
-
-            soup = BeautifulSoup(response.text, 'html.parser')
-            remote_files = {a['href'] for a in soup.find_all('a') if a['href'].endswith('.png')}
-            
-            local_files = {f.name for f in cover_dir.glob('*.png')}
-            
-            missing_files = remote_files - local_files
-            
-            if not missing_files:
-                logger.info("所有封面文件均已为最新，无需更新。")
-                return
-
-            logger.info(f"发现 {len(missing_files)} 个缺失的封面，开始下载...")
-
-            tasks = []
-            async with httpx.AsyncClient() as client:
-                for filename in missing_files:
-                    url = f"{COVER_URL}{filename}"
-                    path = cover_dir / filename
-                    tasks.append(download_cover(client, url, path))
-                
-                results = await asyncio.gather(*tasks)
-            
-            successful_downloads = sum(1 for r in results if r)
-            logger.info(f"封面更新完成。成功下载 {successful_downloads} / {len(missing_files)} 个文件。")
-
+        stats = await cover_sync.sync()
+        if stats.get("downloaded"):
+            # 已缓存的图片可能用占位封面或旧封面绘制
+            await image_cache.clear()
+        return stats
     except Exception as e:
-        logger.error(f"更新封面时发生未知错误: {e}")
\ No newline at end of file
+        logger.error(f"更新封面时发生未知错误: {e}")